@@ -0,0 +1,453 @@
+import glob
+import json
+import mmap
+import os
+import re
+from collections import namedtuple
+
+from six import iteritems
+
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import sympy as sym
+
+from mass.util.expressions import strip_time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+# Temperature in K and gas constant in kJ / (mol * K) for Gibbs energies
+ANALYSIS_TEMPERATURE = 313.15
+GAS_CONSTANT = 8.314 / 1000
+
+# Top-level keys of MASS JSON models, which are written with an indent of
+# four spaces, so that nested keys are always indented further. Matching
+# the newline instead of a line anchor lets the regex search for a prefix.
+json_section_re = re.compile(br'\n {4}"(\w+)": ')
+
+# Tables of the values of each model in an ensemble store
+ENSEMBLE_STORE_TABLES = [
+    "initial_conditions", "boundary_conditions", "steady_state_fluxes",
+    "equilibrium_constants", "forward_rate_constants",
+    "enzyme_concentration_totals"]
+ENSEMBLE_STORE_FORMS_TABLE = "enzyme_module_forms"
+
+# Values per model, enzyme module and form, padded with NaN for enzyme
+# modules with fewer forms, and the IDs of each axis. Forms are a list of
+# form IDs for each enzyme module.
+EnzymeFormArray = namedtuple(
+    "EnzymeFormArray", ["values", "models", "enzymes", "forms"])
+
+
+def ensemble_concentrations(models):
+    """Return initial conditions of ensemble models as a single DataFrame.
+
+    Rows are models and columns are metabolites and boundary metabolites.
+    Values missing from a model are NaN. Models may also be
+    :class:`LazyMassModel` objects.
+    """
+    columns = {}
+    values_per_model = []
+    for model in models:
+        values = {
+            getattr(m, "id", m): ic
+            for m, ic in iteritems(model.initial_conditions)}
+        values.update({
+            str(b): bc for b, bc in iteritems(model.boundary_conditions)})
+        for key in values:
+            columns.setdefault(key, len(columns))
+        values_per_model.append(values)
+
+    array = np.full((len(values_per_model), len(columns)), np.nan)
+    for row, values in zip(array, values_per_model):
+        row[[columns[key] for key in values]] = list(values.values())
+
+    return pd.DataFrame(
+        array, index=pd.Index([model.id for model in models], name="model"),
+        columns=list(columns))
+
+
+def disequilibrium_ratio_function(mass_model, Keq_values=None):
+    """Return a function evaluating the disequilibrium ratios of a model.
+
+    Equilibrium constants are substituted before the ratios of all
+    non-boundary reactions are lambdified into one function. Returns the
+    function, the reaction IDs in the order of its results, and the
+    metabolite IDs in the order of its arguments.
+    """
+    if Keq_values is None:
+        Keq_values = {r.Keq_str: r.Keq for r in mass_model.reactions}
+    Keq_values = {sym.Symbol(k): v for k, v in iteritems(Keq_values)}
+
+    diseq_expressions = strip_time(mass_model.get_disequilibrium_ratios())
+    reactions, expressions = [], []
+    for reaction, expr in iteritems(diseq_expressions):
+        if reaction.boundary:
+            continue
+        reactions.append(reaction.id)
+        expressions.append(expr.xreplace(Keq_values))
+
+    arguments = sorted(
+        set().union(*[expr.free_symbols for expr in expressions]), key=str)
+    func = sym.lambdify(arguments, expressions, modules="numpy")
+
+    return func, reactions, [str(arg) for arg in arguments]
+
+
+def ensemble_gibbs_energies(mass_model, concentrations, Keq_values=None,
+                            T=ANALYSIS_TEMPERATURE, R=GAS_CONSTANT):
+    """Return R*T*ln(Gamma / Keq) of each reaction for each model.
+
+    The disequilibrium ratios of ``mass_model`` are evaluated once over the
+    whole ``concentrations`` DataFrame, which has one row per model and
+    columns for all metabolites in the ratios, see
+    :func:`ensemble_concentrations`. Equilibrium constants are taken from
+    ``mass_model`` unless ``Keq_values`` are given.
+    """
+    func, reactions, arguments = disequilibrium_ratio_function(
+        mass_model, Keq_values)
+    ratios = func(*[concentrations[arg].values for arg in arguments])
+
+    # Constant ratios are returned as scalars and broadcast into the columns
+    values = np.empty((len(concentrations), len(reactions)))
+    for column, ratio in zip(values.T, ratios):
+        column[:] = ratio
+    np.log(values, out=values)
+    values *= R * T
+
+    return pd.DataFrame(
+        values, index=concentrations.index, columns=reactions)
+
+
+def ensemble_enzyme_forms(models, enzyme_ids=None):
+    """Return enzyme module form concentrations of ensemble models.
+
+    Concentrations are returned as an :class:`EnzymeFormArray` with axes of
+    models, enzyme modules and forms. Forms are ordered as in the first
+    model and enzyme modules with fewer forms are padded with NaN.
+    """
+    if enzyme_ids is None:
+        enzyme_ids = [e.id for e in models[0].enzyme_modules]
+    forms = [
+        [e.id for e in models[0].enzyme_modules.get_by_id(
+            enzyme_id).enzyme_module_forms]
+        for enzyme_id in enzyme_ids]
+
+    values = np.full(
+        (len(models), len(enzyme_ids), max(len(f) for f in forms)), np.nan)
+    for i, model in enumerate(models):
+        for j, (enzyme_id, form_ids) in enumerate(zip(enzyme_ids, forms)):
+            ics = {
+                e.id: e.ic for e in model.enzyme_modules.get_by_id(
+                    enzyme_id).enzyme_module_forms}
+            values[i, j, :len(form_ids)] = [ics[f] for f in form_ids]
+
+    return EnzymeFormArray(
+        values, [model.id for model in models], list(enzyme_ids), forms)
+
+
+def fractional_abundances(enzyme_forms):
+    """Return the fraction of each enzyme total in each enzyme module form.
+
+    Fractions of all enzyme modules in all models are calculated at once
+    from an :class:`EnzymeFormArray` of form concentrations.
+    """
+    totals = np.nansum(enzyme_forms.values, axis=2, keepdims=True)
+    return enzyme_forms._replace(values=enzyme_forms.values / totals)
+
+
+def enzyme_form_frame(enzyme_forms, enzyme_id):
+    """Return the values of one enzyme module as a DataFrame of models."""
+    j = enzyme_forms.enzymes.index(enzyme_id)
+    forms = enzyme_forms.forms[j]
+    return pd.DataFrame(
+        enzyme_forms.values[:, j, :len(forms)],
+        index=pd.Index(enzyme_forms.models, name="model"), columns=forms)
+
+
+def plot_fractional_abundances(abundances, enzyme_ids, axes=None,
+                               color="xkcd:green"):
+    """Plot boxplots of fractional abundances, one axis per enzyme module.
+
+    ``abundances`` is an :class:`EnzymeFormArray` of fractional abundances,
+    see :func:`fractional_abundances`. A new figure is made if no axes are
+    given. Returns the axes.
+    """
+    if axes is None:
+        _, axes = plt.subplots(
+            nrows=1, ncols=len(enzyme_ids), figsize=(5 * len(enzyme_ids), 5),
+            squeeze=False)
+        axes = axes[0]
+
+    face_color = list(mpl.colors.to_rgba(color))
+    for ax, enzyme_id in zip(axes, enzyme_ids):
+        ax, boxes = enzyme_form_frame(abundances, enzyme_id).boxplot(
+            ax=ax, vert=True, patch_artist=True, rot=45, return_type="both")
+        ax.set_ylim([-0.05, 1.05])
+        ax.set_ylabel("Fractional Abundance")
+        ax.set_title(enzyme_id)
+        for item in boxes["boxes"]:
+            item.set_color("black")
+            item.set_facecolor(face_color)
+            item.set_linewidth(3)
+        for item in boxes["fliers"]:
+            item.set_markerfacecolor(face_color)
+            item.set_markeredgewidth(1)
+            item.set_markeredgecolor("black")
+        for key in ["whiskers", "caps"]:
+            for item in boxes[key]:
+                item.set_color(color)
+        for item in boxes["medians"]:
+            item.set_color("black")
+
+    return axes
+
+
+def index_json_sections(contents):
+    """Return the byte offsets of the top-level sections of a MASS JSON model.
+
+    Returns a dict of section names and the start and end of their values,
+    or ``None`` if the file is not laid out as written by MASSpy.
+    """
+    matches = list(json_section_re.finditer(contents))
+    if not matches:
+        return None
+    ends = [match.start() for match in matches[1:]]
+    ends.append(contents.rfind(b"}"))
+
+    sections = {}
+    for match, end in zip(matches, ends):
+        # Exclude the separator between sections
+        end = contents.rfind(b",", match.end(), end) \
+            if match is not matches[-1] else end
+        sections[match.group(1).decode()] = (match.end(), end)
+
+    return sections
+
+
+class LazyMassModel(object):
+    """Read-only view of the values in a MASS JSON model.
+
+    The file is memory-mapped to index its top-level sections without
+    parsing them. Sections are only parsed when they are accessed and no
+    model objects or rate expressions are built, making it cheap to read
+    a few values from many ensemble models.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._parsed = {}
+        with open(filename, "rb") as f:
+            contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self._sections = index_json_sections(contents)
+            finally:
+                contents.close()
+        # Parse the whole model at once if it cannot be indexed
+        if self._sections is None:
+            with open(filename) as f:
+                self._parsed = json.load(f)
+            self._sections = dict.fromkeys(self._parsed)
+
+    def __repr__(self):
+        return "<LazyMassModel {0} at {1}>".format(
+            self.filename, hex(id(self)))
+
+    @property
+    def sections(self):
+        """Return the names of the top-level sections of the model."""
+        return list(self._sections)
+
+    def section(self, name):
+        """Return the parsed contents of a top-level section."""
+        if name not in self._parsed:
+            start, end = self._sections[name]
+            with open(self.filename, "rb") as f:
+                contents = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self._parsed[name] = json.loads(
+                        contents[start:end].decode())
+                finally:
+                    contents.close()
+
+        return self._parsed[name]
+
+    @property
+    def id(self):
+        return self.section("id")
+
+    @property
+    def initial_conditions(self):
+        """Return a dict of metabolite IDs and initial conditions."""
+        return {
+            m["id"]: m["_initial_condition"]
+            for m in self.section("metabolites")
+            if m.get("_initial_condition") is not None}
+
+    @property
+    def boundary_conditions(self):
+        """Return a dict of boundary metabolite IDs and their conditions."""
+        return self.section("boundary_conditions")
+
+    @property
+    def steady_state_fluxes(self):
+        """Return a dict of reaction IDs and steady state fluxes."""
+        return self._reaction_values("steady_state_flux")
+
+    @property
+    def equilibrium_constants(self):
+        """Return a dict of reaction IDs and equilibrium constants."""
+        return self._reaction_values("_equilibrium_constant")
+
+    @property
+    def forward_rate_constants(self):
+        """Return a dict of reaction IDs and forward rate constants."""
+        return self._reaction_values("_forward_rate_constant")
+
+    @property
+    def enzyme_concentration_totals(self):
+        """Return a dict of enzyme module IDs and their enzyme totals."""
+        return {
+            e["id"]: e.get("enzyme_concentration_total")
+            for e in self.section("enzyme_modules")}
+
+    @property
+    def enzyme_module_forms(self):
+        """Return a dict of enzyme module IDs and the IDs of their forms."""
+        return {
+            e["id"]: e.get("enzyme_module_forms", [])
+            for e in self.section("enzyme_modules")}
+
+    def _reaction_values(self, key):
+        """Return a dict of reaction IDs and values for a reaction key."""
+        return {
+            r["id"]: r[key] for r in self.section("reactions")
+            if r.get(key) is not None}
+
+
+def scan_ensemble_models(path_to_dir, attribute, pattern="*.json"):
+    """Return one attribute of every model in a directory as a DataFrame.
+
+    Models are read with :class:`LazyMassModel`, so only the sections
+    needed for ``attribute``, e.g. "initial_conditions", are parsed. Rows
+    are model IDs.
+    """
+    values = {}
+    for filepath in sorted(glob.glob(os.path.join(path_to_dir, pattern))):
+        model = LazyMassModel(filepath)
+        values[model.id] = getattr(model, attribute)
+
+    return pd.DataFrame.from_dict(values, orient="index").rename_axis("model")
+
+
+def ensemble_model_values(model):
+    """Return the values of a model for each table of an ensemble store.
+
+    The model may be a MASS model or a :class:`LazyMassModel`. Returns a
+    dict of table names and dicts of IDs and values, and a list of
+    enzyme module, form and concentration tuples.
+    """
+    if isinstance(model, LazyMassModel):
+        values = {table: getattr(model, table)
+                  for table in ENSEMBLE_STORE_TABLES}
+        forms = [
+            (enzyme_id, form_id, values["initial_conditions"].get(form_id))
+            for enzyme_id, form_ids in iteritems(model.enzyme_module_forms)
+            for form_id in form_ids]
+        return values, forms
+
+    values = {
+        "initial_conditions": {
+            m.id: ic for m, ic in iteritems(model.initial_conditions)},
+        "boundary_conditions": {
+            str(b): bc for b, bc in iteritems(model.boundary_conditions)},
+        "steady_state_fluxes": {
+            r.id: v for r, v in iteritems(model.steady_state_fluxes)
+            if v is not None},
+        "equilibrium_constants": {
+            r.id: r.Keq for r in model.reactions if r.Keq is not None},
+        "forward_rate_constants": {
+            r.id: r.kf for r in model.reactions if r.kf is not None},
+        "enzyme_concentration_totals": {
+            e.id: e.enzyme_concentration_total
+            for e in model.enzyme_modules}}
+    forms = [
+        (enzyme.id, form.id, form.ic) for enzyme in model.enzyme_modules
+        for form in enzyme.enzyme_module_forms]
+    return values, forms
+
+
+def _check_pyarrow():
+    """Raise an ImportError if pyarrow is not installed."""
+    if pa is None:
+        raise ImportError(
+            "pyarrow is required for reading and writing ensemble stores.")
+
+
+def write_ensemble_store(models, path_to_dir):
+    """Write the numeric values of an ensemble of models to Parquet files.
+
+    One Parquet file is written per table, see ``ENSEMBLE_STORE_TABLES``,
+    with a row per model and a column per ID, and one long table of enzyme
+    module form concentrations. Every table has a "model" column with the
+    model IDs. Models may be MASS models or :class:`LazyMassModel` objects.
+    """
+    _check_pyarrow()
+    if not os.path.isdir(path_to_dir):
+        os.makedirs(path_to_dir)
+
+    model_ids = []
+    table_values = {table: [] for table in ENSEMBLE_STORE_TABLES}
+    forms = []
+    for model in models:
+        values, model_forms = ensemble_model_values(model)
+        model_ids.append(model.id)
+        for table, table_rows in iteritems(table_values):
+            table_rows.append(values[table])
+        forms.extend((model.id,) + form for form in model_forms)
+
+    for table, rows in iteritems(table_values):
+        df = pd.DataFrame.from_records(rows).astype(float)
+        df.insert(0, "model", model_ids)
+        pq.write_table(
+            pa.Table.from_pandas(df, preserve_index=False),
+            os.path.join(path_to_dir, table + ".parquet"))
+
+    df = pd.DataFrame.from_records(
+        forms, columns=["model", "enzyme", "form", "concentration"])
+    pq.write_table(
+        pa.Table.from_pandas(df, preserve_index=False),
+        os.path.join(path_to_dir, ENSEMBLE_STORE_FORMS_TABLE + ".parquet"))
+
+
+def read_ensemble_store(path_to_dir, table, columns=None, models=None,
+                        as_arrow=False):
+    """Read one table of an ensemble store, see :func:`write_ensemble_store`.
+
+    Only the given ``columns`` and the rows of the given ``models`` are read.
+    Returns a DataFrame indexed by model ID, or the Arrow table including
+    the "model" column if ``as_arrow`` is True.
+    """
+    _check_pyarrow()
+    if columns is not None:
+        columns = ["model"] + [c for c in columns if c != "model"]
+    filters = None
+    if models is not None:
+        filters = [("model", "in", list(models))]
+    arrow_table = pq.read_table(
+        os.path.join(path_to_dir, table + ".parquet"), columns=columns,
+        filters=filters)
+    if as_arrow:
+        return arrow_table
+
+    df = arrow_table.to_pandas()
+    if table == ENSEMBLE_STORE_FORMS_TABLE:
+        return df.set_index(["model", "enzyme", "form"])
+    return df.set_index("model")
@@ -0,0 +1,447 @@
+"""Time the construction of enzyme modules from the enzyme module data.
+
+Usage::
+
+    python benchmark_construction.py --enzymes PFK1 FBA1 PYK2
+    python benchmark_construction.py --suite --output results.json
+    python benchmark_construction.py --suite --compare baseline.json
+
+Each enzyme module is built with the original symbolic substitution and with
+compiled equations so that the two can be compared. Pass ``--cache-dir`` and
+run twice to measure builds from the on-disk equation cache. Pass
+``--substitution`` to time only the variable substitution in the equations,
+``--memory`` to compare the peak memory used to parse the equations and
+check that streaming lowers it, or ``--reactions`` to time reading reactions
+for growing synthetic modules.
+
+With ``--suite``, every enzyme in the enzyme module data (or those given by
+``--enzymes``) is built with compiled equations for each of ``--kclusters``,
+recording the wall time and peak memory of every construction stage. Stage
+times include the overhead of tracing memory, while the total build time is
+measured in a separate build without tracing. The records are written as
+JSON to ``--output`` together with the commit and package versions, so that
+runs can be compared across commits with ``--compare``. The suite only reads
+the data files and runs offline.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import sympy as sym
+
+from mass import MassMetabolite
+from mass.enzyme_modules import EnzymeModule, EnzymeModuleReaction
+
+from six import iteritems
+
+from construction_functions import (
+    fix_equation_variables, make_enzyme_module_from_dir,
+    make_enzyme_module_structure_from_dir, make_path, metabolites_from_txt,
+    open_enzyme_file, parse_equation_file, path_to_enzyme_file,
+    prefix_number_id, profile_report, reactions_from_txt, sympify_equation)
+
+
+DATA_DIR = make_path(os.path.dirname(__file__), "data")
+ENZYME_DATA_DIR = make_path(DATA_DIR, "enzyme_module_data")
+
+# Same conversion used in the COBRA to MASS workflow notebook
+# mmol * gDW-1 * h-1 --> mol * L-1 * s-1
+GDW_L_CONVERSION_FACTOR = (1.1 * 3.2e-12) / (3.2 * 0.7 * 1e-15)
+FLUX_CONVERSION_FACTOR = GDW_L_CONVERSION_FACTOR * 0.001 / 3600
+
+# Metabolites without measured concentrations and their initial guesses
+DEFAULT_CONCENTRATIONS = {
+    "h_c": 1,
+    "h2o_c": 1,
+    "pi_c": 0.001,
+    "g3p_c": 0.001,
+    "lac__D_c": 0.001,
+}
+
+ISOZYME_FLUX_SPLITS = {
+    "PFK": {"PFK1": 0.9, "PFK2": 0.1},
+    "FBP": {"FBP1": 0.9, "FBP2": 0.1},
+    "FBA": {"FBA1": 0.9, "FBA2": 0.1},
+    "PGM": {"PGMi": 0.9, "PGMd": 0.1},
+    "PYK": {"PYK1": 0.9, "PYK2": 0.1},
+}
+
+
+def load_concentrations():
+    """Return metabolite concentrations keyed by MassMetabolite."""
+    conc_data = pd.read_csv(
+        make_path(DATA_DIR, "analysis_data", "concentrations.csv"),
+        index_col=0)
+    concentrations = dict(DEFAULT_CONCENTRATIONS)
+    concentrations.update(conc_data["Adjusted"].to_dict())
+    return {MassMetabolite(mid): ic for mid, ic in concentrations.items()}
+
+
+def load_enzyme_fluxes():
+    """Return steady state fluxes in mol * L-1 * s-1 keyed by enzyme ID."""
+    flux_data = pd.read_csv(
+        make_path(DATA_DIR, "analysis_data", "fluxes.csv"), index_col=0)
+    enzyme_fluxes = {}
+    for enzyme_id in sorted(os.listdir(ENZYME_DATA_DIR)):
+        # Skip packed enzyme data next to the enzyme directories
+        if not os.path.isdir(make_path(ENZYME_DATA_DIR, enzyme_id)):
+            continue
+        for rid, isozymes in ISOZYME_FLUX_SPLITS.items():
+            if enzyme_id in isozymes:
+                flux_split = isozymes[enzyme_id]
+                break
+        else:
+            rid, flux_split = enzyme_id, 1
+        flux = flux_data.loc[rid, "Adjusted"] * FLUX_CONVERSION_FACTOR
+        # PGM & PGK have reversed stoichiometry in the enzyme module
+        if rid in ["PGK", "PGM"]:
+            flux = -flux
+        enzyme_fluxes[enzyme_id] = flux * flux_split
+    return enzyme_fluxes
+
+
+def time_enzyme_module(enzyme_id, steady_state_flux, concentrations,
+                       **kwargs):
+    """Return the wall time in seconds to build an enzyme module."""
+    start = time.perf_counter()
+    make_enzyme_module_from_dir(
+        enzyme_id=enzyme_id,
+        steady_state_flux=steady_state_flux,
+        metabolite_concentrations=concentrations,
+        path_to_dir=ENZYME_DATA_DIR,
+        **kwargs)
+    return time.perf_counter() - start
+
+
+def fix_equation_variables_sequential(enzyme_module, equation_str):
+    """Substitute equation variables with one regex pass per ID.
+
+    Reference implementation that ``fix_equation_variables`` replaced.
+    """
+    for cid in enzyme_module.compartments:
+        equation_str = re.sub(
+            r"\({0}\)".format(cid), "[{0}]".format(cid), equation_str)
+        equation_str = re.sub(
+            "_".join(("param", "Volume", cid)), "1", equation_str)
+        equation_str = re.sub(
+            "_".join(("param", enzyme_module.id, "total")),
+            enzyme_module.enzyme_total_symbol_str, equation_str)
+
+    for dtype in ["species", "kf", "kr"]:
+        for old_id, new_id in iteritems(enzyme_module.id_map[dtype]):
+            equation_str = re.sub(
+                re.escape(old_id), lambda match: new_id, equation_str)
+    return equation_str
+
+
+def equation_filepaths(enzyme_id):
+    """Return the filepaths of the rate law and enzyme form equations."""
+    return [
+        filepath for filepath in sorted(glob.glob(
+            make_path(ENZYME_DATA_DIR, enzyme_id, "*.txt")))
+        if os.path.basename(filepath).startswith(("equation_", "rateLaw_"))
+        # Labels list the species of the equations instead of an equation
+        and not os.path.basename(filepath).startswith("equation_labels_")]
+
+
+def time_substitution(enzyme_id, repeat=10):
+    """Return wall times in seconds to substitute all equation variables."""
+    enzyme_module = make_enzyme_module_structure_from_dir(
+        enzyme_id, path_to_dir=ENZYME_DATA_DIR)
+    equations = []
+    for filepath in equation_filepaths(enzyme_id):
+        with open(filepath, "r") as file:
+            equations.append(file.read())
+
+    times = {}
+    for label, function in [("sequential", fix_equation_variables_sequential),
+                            ("single_pass", fix_equation_variables)]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for equation_str in equations:
+                function(enzyme_module, equation_str)
+        times[label] = time.perf_counter() - start
+    return times
+
+
+def parse_equation_file_whole(enzyme_module, filepath):
+    """Parse an equation file by reading, fixing and sympifying it whole."""
+    with open(filepath, "r") as file:
+        equation_str = file.read()
+    return sympify_equation(
+        enzyme_module, fix_equation_variables(enzyme_module, equation_str))
+
+
+def measure_parse_memory(enzyme_id):
+    """Return the largest peak memory in MB to parse any equation file."""
+    enzyme_module = make_enzyme_module_structure_from_dir(
+        enzyme_id, path_to_dir=ENZYME_DATA_DIR)
+    peaks = {}
+    for label, function in [("whole", parse_equation_file_whole),
+                            ("streamed", parse_equation_file)]:
+        peaks[label] = 0
+        for filepath in equation_filepaths(enzyme_id):
+            tracemalloc.start()
+            function(enzyme_module, filepath)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            peaks[label] = max(peaks[label], peak / 1024 ** 2)
+    return peaks
+
+
+def check_parse_memory(enzyme_ids):
+    """Measure parse memory and check that streaming lowers the peak.
+
+    Raises an AssertionError naming the enzymes for which streaming the
+    equation files does not use less memory than parsing them whole.
+    Returns the peak memory in MB for every enzyme.
+    """
+    results = pd.DataFrame.from_dict(
+        {enzyme_id: measure_parse_memory(enzyme_id)
+         for enzyme_id in enzyme_ids}, orient="index")
+    failed = results.index[results["streamed"] >= results["whole"]]
+    assert not len(failed), \
+        "Streamed parsing does not lower the peak memory for {0}".format(
+            ", ".join(failed))
+    return results
+
+
+def reactions_from_txt_sequential(enzyme_module, reactions_filepath):
+    """Create reactions by substituting specie IDs one at a time.
+
+    Reference implementation that ``reactions_from_txt`` replaced.
+    """
+    enzyme_module.id_map["reactions"] = {}
+    with open(reactions_filepath, "r") as f:
+        reaction_strings = [l.strip() for l in f.readlines()]
+
+    for reaction_str in reaction_strings:
+        orig_id, reaction_str = reaction_str.split(r": ")
+        new_id = prefix_number_id(re.sub(r"\$", "_", orig_id))
+        reaction = EnzymeModuleReaction(
+            id_or_reaction=new_id,
+            enzyme_module_id=enzyme_module.id)
+        enzyme_module.add_reactions([reaction])
+
+        species_list = [
+            specie_id for side in reaction_str.strip().split(r" <=> ")
+            for specie_id in side.split(r" + ")]
+        for specie_id in species_list:
+            reaction_str = re.sub(
+                re.escape(specie_id),
+                enzyme_module.id_map["species"][specie_id],
+                reaction_str, 1)
+        reaction.build_reaction_from_string(reaction_str)
+        enzyme_module.id_map["reactions"][orig_id] = new_id
+
+
+def write_binding_module_data(path_to_dir, n_ligands):
+    """Write species and reactions of an enzyme binding many ligands."""
+    enzyme_id = "SYN"
+    enzyme = "E_{0}[c]".format(enzyme_id)
+    species = [enzyme]
+    reactions = []
+    for i in range(n_ligands):
+        ligand, form = "s{0:d}[c]".format(i), "{0}&s{1:d}".format(enzyme, i)
+        species.extend([ligand, form])
+        reactions.append("{0}{1:d}: {2} + {3} <=> {4}".format(
+            enzyme_id, i + 1, enzyme, ligand, form))
+    filepaths = []
+    for type_str, lines in [("species", species), ("reactions", reactions)]:
+        filepaths.append(make_path(path_to_dir, "{0}_{1}.txt".format(
+            type_str, enzyme_id.lower())))
+        with open(filepaths[-1], "w") as f:
+            f.write("\n".join(lines))
+    return enzyme_id, filepaths
+
+
+def time_reactions(n_ligands):
+    """Return wall times in seconds to read reactions for an enzyme."""
+    path_to_dir = tempfile.mkdtemp()
+    try:
+        enzyme_id, (species_filepath, reactions_filepath) = \
+            write_binding_module_data(path_to_dir, n_ligands)
+        times = {}
+        for label, function in [("sequential", reactions_from_txt_sequential),
+                                ("bulk", reactions_from_txt)]:
+            enzyme_module = EnzymeModule(enzyme_id)
+            enzyme_module.id_map = {}
+            metabolites_from_txt(enzyme_module, species_filepath)
+            start = time.perf_counter()
+            function(enzyme_module, reactions_filepath)
+            times[label] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(path_to_dir)
+    return times
+
+
+def count_rateconst_clusters(enzyme_id):
+    """Return the number of rate constant clusters of an enzyme."""
+    with open_enzyme_file(path_to_enzyme_file(
+            ENZYME_DATA_DIR, enzyme_id, "rateconst_clusters")) as f:
+        return len([line for line in f.readlines() if line.strip()])
+
+
+def suite_metadata():
+    """Return the commit and versions that a suite run was made with."""
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(DATA_DIR),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sympy": sym.__version__,
+    }
+
+
+def run_suite(enzyme_ids, kclusters, cache_dir=None):
+    """Build enzyme modules and return the profile record of every stage.
+
+    Kclusters beyond the number of rate constant clusters of an enzyme are
+    skipped. Stages are timed while memory is traced, which slows them
+    down, so every enzyme module is first built without profiling and that
+    time is added as the ``total`` stage.
+    """
+    concentrations = load_concentrations()
+    enzyme_fluxes = load_enzyme_fluxes()
+    records = []
+    for enzyme_id in enzyme_ids:
+        n_clusters = count_rateconst_clusters(enzyme_id)
+        for kcluster in kclusters:
+            if kcluster > n_clusters:
+                continue
+            total_time = time_enzyme_module(
+                enzyme_id, enzyme_fluxes[enzyme_id], concentrations,
+                kcluster=kcluster, zero_tol=1e-10, compiled=True,
+                cache_dir=cache_dir)
+            profile = []
+            time_enzyme_module(
+                enzyme_id, enzyme_fluxes[enzyme_id], concentrations,
+                kcluster=kcluster, zero_tol=1e-10, compiled=True,
+                cache_dir=cache_dir, profile=profile)
+            profile.append({
+                "stage": "total", "file": None, "time": total_time,
+                "peak_memory": max(r["peak_memory"] for r in profile),
+                "nodes": None})
+            for record in profile:
+                record.update({"enzyme": enzyme_id, "kcluster": kcluster})
+            records.extend(profile)
+    return records
+
+
+def summarize_suite(records):
+    """Return the time in seconds per enzyme, kcluster and stage."""
+    return pd.pivot_table(
+        profile_report(records).assign(
+            enzyme=[r["enzyme"] for r in records],
+            kcluster=[r["kcluster"] for r in records]),
+        index=["enzyme", "kcluster"], columns="stage", values="time",
+        aggfunc="sum")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--enzymes", nargs="+", default=None,
+                        help="Enzymes to build, defaults to PFK1 FBA1 PYK2 "
+                             "or to all enzymes with --suite.")
+    parser.add_argument("--kcluster", type=int, default=1)
+    parser.add_argument("--suite", action="store_true",
+                        help="Profile every stage of compiled builds.")
+    parser.add_argument("--kclusters", nargs="+", type=int,
+                        default=[1, 2, 3],
+                        help="Kclusters to build with --suite.")
+    parser.add_argument("--output", default=None,
+                        help="JSON file to write --suite results to.")
+    parser.add_argument("--compare", default=None,
+                        help="JSON file of an earlier --suite run to compare "
+                             "the times against.")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory for cached parsed equations.")
+    parser.add_argument("--substitution", action="store_true",
+                        help="Only time the equation variable substitution.")
+    parser.add_argument("--memory", action="store_true",
+                        help="Only measure peak memory to parse equations.")
+    parser.add_argument("--reactions", nargs="*", type=int, default=None,
+                        help="Only time reading reactions for the given "
+                             "numbers of reactions.")
+    args = parser.parse_args()
+
+    if args.suite:
+        enzyme_ids = args.enzymes or sorted(
+            enzyme_id for enzyme_id in os.listdir(ENZYME_DATA_DIR)
+            if os.path.isdir(make_path(ENZYME_DATA_DIR, enzyme_id)))
+        records = run_suite(enzyme_ids, args.kclusters, args.cache_dir)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump({"metadata": suite_metadata(), "records": records},
+                          f, indent=1)
+        results = summarize_suite(records)
+        if args.compare is not None:
+            with open(args.compare, "r") as f:
+                baseline = summarize_suite(json.load(f)["records"])
+            results = results / baseline.reindex_like(results)
+            print("Time relative to {0}".format(args.compare))
+        print(results.to_string(float_format="{:.3f}".format))
+        print("Stage times include the overhead of tracing memory, the "
+              "total is timed without tracing.")
+        return
+
+    args.enzymes = args.enzymes or ["PFK1", "FBA1", "PYK2"]
+    if args.reactions is not None:
+        results = pd.DataFrame.from_dict(
+            {n: time_reactions(n) for n in args.reactions or [10, 100, 1000]},
+            orient="index")
+        results["speedup"] = results["sequential"] / results["bulk"]
+        results.index.name = "reactions"
+        print(results.to_string(float_format="{:.3f}".format))
+        return
+
+    if args.substitution:
+        results = pd.DataFrame.from_dict(
+            {enzyme_id: time_substitution(enzyme_id)
+             for enzyme_id in args.enzymes}, orient="index")
+        results["speedup"] = results["sequential"] / results["single_pass"]
+        print(results.to_string(float_format="{:.3f}".format))
+        return
+
+    if args.memory:
+        results = check_parse_memory(args.enzymes)
+        results["reduction"] = results["whole"] / results["streamed"]
+        print(results.to_string(float_format="{:.3f}".format))
+        return
+
+    concentrations = load_concentrations()
+    enzyme_fluxes = load_enzyme_fluxes()
+    results = {}
+    for enzyme_id in args.enzymes:
+        results[enzyme_id] = {
+            label: time_enzyme_module(
+                enzyme_id, enzyme_fluxes[enzyme_id], concentrations,
+                kcluster=args.kcluster, zero_tol=1e-10, compiled=compiled,
+                cache_dir=args.cache_dir)
+            for label, compiled in [("symbolic", False), ("compiled", True)]
+        }
+    results = pd.DataFrame.from_dict(results, orient="index")
+    results["speedup"] = results["symbolic"] / results["compiled"]
+    print(results.to_string(float_format="{:.3f}".format))
+
+
+if __name__ == "__main__":
+    main()
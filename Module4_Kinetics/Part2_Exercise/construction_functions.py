@@ -1,17 +1,30 @@
 
+import hashlib
+import io
+import json
+import marshal
 import os
+import pickle
 import re
-from operator import attrgetter, iconcat
+import sys
+import time
+import tracemalloc
+import types
+import warnings
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from operator import add, attrgetter, mul, neg, sub, truediv
 
-from six import iteritems
+from six import iteritems, itervalues, string_types
 
+import numpy as np
 import pandas as pd
 import sympy as sym
 
 from mass import MassMetabolite
 from mass.enzyme_modules import (
     EnzymeModule, EnzymeModuleForm, EnzymeModuleReaction)
-from mass.util.expressions import strip_time
 
 
 # Pre-compiled regex
@@ -20,6 +33,47 @@ rateconst_re = re.compile(r"k_(\S*)_(fwd|rev)\Z")
 bound_metabolites_re = re.compile(r"&|@|#")
 modified_re = re.compile(r"mod")
 modified_upper_re = re.compile(r"MODIFIED")
+compartment_paranthesis_re = re.compile(r"\((\w+)\)\Z")
+
+# Maximum size in bytes of an equation cache directory before eviction
+EQUATION_CACHE_MAX_SIZE = 256 * 1024 ** 2
+
+# Fraction of the maximum size an equation cache is pruned down to, so that
+# a full cache is not pruned again on every following write
+EQUATION_CACHE_PRUNE_FRACTION = 0.75
+
+# Fraction of the maximum size written by a process before the size of an
+# equation cache is read from disk again, to count entries written by
+# other processes sharing the cache
+EQUATION_CACHE_REFRESH_FRACTION = 0.05
+
+# Total size in bytes of the equation cache directories written to so far
+# and the bytes written by this process since the size was read from disk
+equation_cache_sizes = {}
+
+# Number of characters read at a time when streaming equation files
+EQUATION_CHUNK_SIZE = 64 * 1024
+
+# Binary operators in equations with their precedence and associativity
+equation_operators = {
+    "+": (add, 1, False),
+    "-": (sub, 1, False),
+    "*": (mul, 2, False),
+    "/": (truediv, 2, False),
+    "**": (pow, 4, True),
+}
+# Precedence of unary minus, binding looser than powers like in Python
+UNARY_MINUS_PRECEDENCE = 3
+
+# File extension of packed enzyme module data, the number of packed files
+# kept in memory and the packed files loaded so far, least recently used
+# first
+ENZYME_DATA_BUNDLE_EXT = ".npz"
+ENZYME_DATA_BUNDLE_CACHE_SIZE = 4
+enzyme_data_bundles = {}
+# Whether each packed file is newer than its enzyme directory, keyed by the
+# modification time of the packed file when it was checked
+enzyme_data_bundle_checks = {}
 
 def format_percent_str(percent):
     return str(int(round(percent * 100, 0))).replace(".", "")
@@ -36,33 +90,580 @@ def make_path(*args):
     """Combine path arguments and return absolute filepath."""
     return os.path.abspath(os.path.join(*args))
 
-def fix_equation_variables(enzyme_module, equation_str):
-    """Make corrections for equation strings in order to sympify."""
-    # Correct compartments paranthesis to brackets
-    for cid in enzyme_module.compartments:
-        c_str = r"\({0}\)".format(cid)
-        equation_str = re.sub(
-            c_str, lambda match: "[{0}]".format(cid), equation_str)
 
-        vol_str = "_".join(("param", "Volume", cid))
-        if vol_str in equation_str:
-            equation_str = re.sub(vol_str, "1", equation_str)
+@contextmanager
+def profile_stage(profile, stage, filepath=None):
+    """Record the wall time and peak memory of a construction stage.
+
+    Nothing is recorded if ``profile`` is None. Otherwise a record is
+    appended to the ``profile`` list when the stage exits. An expression
+    stored under ``"expression"`` in the yielded record is replaced by its
+    number of nodes, or by the ``nodes`` attribute of a compiled function.
+    Memory is traced while profiling, which slows down the stage being
+    timed.
+
+    If memory is already being traced, e.g. by an enclosing stage, the peak
+    of a stage is only known when it exceeds the peak before the stage.
+    Otherwise the memory still allocated at the end of the stage is
+    recorded instead, or zero if the stage freed more than it allocated.
+    """
+    if profile is None:
+        yield {}
+        return
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    record = {
+        "stage": stage,
+        "file": os.path.basename(filepath) if filepath else None}
+    start_memory, start_peak = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["time"] = time.perf_counter() - start
+        end_memory, end_peak = tracemalloc.get_traced_memory()
+        if end_peak == start_peak:
+            end_peak = end_memory
+        # Memory freed during the stage is not counted against its peak
+        record["peak_memory"] = max(end_peak - start_memory, 0)
+        if not tracing:
+            tracemalloc.stop()
+        expression = record.pop("expression", None)
+        record["nodes"] = count_nodes(expression) \
+            if isinstance(expression, sym.Basic) \
+            else getattr(expression, "nodes", None)
+        profile.append(record)
+
+
+def count_nodes(expression):
+    """Return the number of nodes of a symbolic expression."""
+    return sum(1 for _ in sym.preorder_traversal(expression))
+
 
-        e_tot_str = "_".join(("param", enzyme_module.id, "total"))
-        if e_tot_str in equation_str:
-            equation_str = re.sub(
-                e_tot_str, enzyme_module.enzyme_total_symbol_str, equation_str)
+def profile_report(profile):
+    """Return the records of a construction profile as a DataFrame.
+
+    Times are in seconds and peak memory in bytes. The records themselves
+    are plain dicts and can be written with ``json.dump``.
+    """
+    return pd.DataFrame(
+        profile, columns=["stage", "file", "time", "peak_memory", "nodes"])
+
+
+def equation_variable_map(enzyme_module):
+    """Return the replacements for variables in equation strings."""
+    replacements = {}
+    for cid in enzyme_module.compartments:
+        replacements["_".join(("param", "Volume", cid))] = "1"
+        replacements["_".join(("param", enzyme_module.id, "total"))] = \
+            enzyme_module.enzyme_total_symbol_str
 
     for dtype in ["species", "kf", "kr"]:
         for old_id, new_id in iteritems(enzyme_module.id_map[dtype]):
-            if dtype == "species":
-                old_id = old_id.replace("[", r"\[").replace("]", r"\]")
-            equation_str = re.sub(old_id, lambda match: new_id, equation_str)
-    return equation_str
+            replacements[old_id] = new_id
+            if dtype != "species":
+                continue
+            # Equations use paranthesis instead of brackets for compartments
+            for cid in enzyme_module.compartments:
+                replacements[old_id.replace(
+                    "[{0}]".format(cid), "({0})".format(cid))] = new_id
+    return replacements
+
+
+def equation_token_regex(enzyme_module):
+    """Return a regex that splits equations around variable names.
+
+    A variable name may be followed by its compartment in paranthesis.
+    Numbers are not matched since they are never replaced.
+    """
+    compartments = "|".join(
+        re.escape(cid)
+        for cid in sorted(enzyme_module.compartments, key=len, reverse=True))
+    return re.compile(
+        r"(\d*[A-Za-z_][\w$]*(?:\((?:{0})\))?|\((?:{0})\))".format(
+            compartments))
+
+
+def fix_equation_variables(enzyme_module, equation_str):
+    """Make corrections for equation strings in order to sympify.
+
+    All variables are replaced in a single pass, with whole variable names
+    looked up in the ID map so that IDs sharing a prefix cannot clash.
+    """
+    replacements = equation_variable_map(enzyme_module)
+    # Split into text and variable names, variable names at odd indices
+    parts = equation_token_regex(enzyme_module).split(equation_str)
+    parts[1::2] = [
+        replacements[variable] if variable in replacements
+        # Correct compartments paranthesis to brackets
+        else compartment_paranthesis_re.sub(r"[\1]", variable)
+        for variable in parts[1::2]]
+    return "".join(parts)
+
+
+def equation_tokenizer_regex(enzyme_module):
+    """Return a regex matching one token of an equation at a time.
+
+    Tokens are numbers, variable names with an optional compartment in
+    paranthesis, and operators. Any other character is matched as an error.
+    """
+    compartments = "|".join(
+        re.escape(cid)
+        for cid in sorted(enzyme_module.compartments, key=len, reverse=True))
+    return re.compile(
+        r"\s*(?:(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![\w$]))"
+        r"|(?P<name>\d*[A-Za-z_][\w$]*(?:\((?:{0})\))?)"
+        r"|(?P<operator>\*\*|[-+*/()])|(?P<error>\S))".format(compartments))
+
+
+def iter_equation_file(filepath, chunk_size=EQUATION_CHUNK_SIZE):
+    """Yield the contents of an equation file in chunks."""
+    with open_enzyme_file(filepath) as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            yield chunk
+
+
+def iter_equation_tokens(enzyme_module, chunks):
+    """Yield the tokens of an equation given in chunks of text.
+
+    Variables are corrected as in ``fix_equation_variables`` and yielded as
+    sympy objects together with numbers, while operators and paranthesis are
+    yielded as strings. Only the current chunk is held in memory.
+    """
+    replacements = equation_variable_map(enzyme_module)
+    token_re = equation_tokenizer_regex(enzyme_module)
+    operands = {}
+
+    def tokenize(text, offset):
+        for match in token_re.finditer(text):
+            kind, value = match.lastgroup, match.group(match.lastgroup)
+            if kind == "error":
+                raise ValueError(
+                    "Unexpected character '{0}' at position {1:d} of the "
+                    "equation.".format(value, offset + match.start(kind)))
+            if kind == "operator":
+                yield value
+                continue
+            if value not in operands:
+                if kind == "number":
+                    operand = sym.Integer(value) if value.isdigit() \
+                        else sym.Float(value)
+                else:
+                    operand = replacements.get(
+                        value, compartment_paranthesis_re.sub(r"[\1]", value))
+                    operand = sym.Integer(operand) if operand.isdigit() \
+                        else sym.Symbol(operand)
+                operands[value] = operand
+            yield operands[value]
+
+    buffer, offset = "", 0
+    for chunk in chunks:
+        buffer += chunk
+        # Only split after characters that cannot continue a token
+        end = max(buffer.rfind(char) for char in " \n)") + 1
+        for token in tokenize(buffer[:end], offset):
+            yield token
+        buffer, offset = buffer[end:], offset + end
+    for token in tokenize(buffer, offset):
+        yield token
+
+
+def build_equation(tokens):
+    """Build a sympy expression from equation tokens.
+
+    Operators are applied in the same order as Python would evaluate the
+    equation string, so the result is the same as from ``sym.sympify``.
+    """
+    operands, operators = [], []
+
+    def apply_operator():
+        operator = operators.pop()
+        if operator == "neg":
+            operands.append(neg(operands.pop()))
+        else:
+            right, left = operands.pop(), operands.pop()
+            operands.append(equation_operators[operator][0](left, right))
+
+    expect_operand = True
+    try:
+        for token in tokens:
+            if not isinstance(token, string_types):
+                operands.append(token)
+                expect_operand = False
+            elif token == "(":
+                operators.append(token)
+            elif token == ")":
+                while operators[-1] != "(":
+                    apply_operator()
+                operators.pop()
+                expect_operand = False
+            elif expect_operand:
+                # Unary operators apply to the following operand
+                if token == "-":
+                    operators.append("neg")
+                elif token != "+":
+                    raise ValueError(
+                        "Unexpected operator '{0}'.".format(token))
+            else:
+                _, precedence, right_assoc = equation_operators[token]
+                while operators and operators[-1] != "(":
+                    top_precedence = UNARY_MINUS_PRECEDENCE \
+                        if operators[-1] == "neg" \
+                        else equation_operators[operators[-1]][1]
+                    if top_precedence < precedence or (
+                       top_precedence == precedence and right_assoc):
+                        break
+                    apply_operator()
+                operators.append(token)
+                expect_operand = True
+        while operators and operators[-1] != "(":
+            apply_operator()
+    except IndexError:
+        raise ValueError("Unbalanced paranthesis or missing operands.")
+    if operators or len(operands) != 1:
+        raise ValueError("Unbalanced paranthesis or missing operands.")
+    return operands[0]
+
+
+def equation_arguments(enzyme_module):
+    """Return the fixed argument order used by compiled equations.
+
+    Arguments are ordered as ligand concentrations, rate constants, and then
+    the enzyme total, each group sorted by identifier.
+    """
+    ligands = sorted(
+        m.id for m in enzyme_module.metabolites
+        if not isinstance(m, EnzymeModuleForm))
+    rateconsts = sorted(set(
+        list(itervalues(enzyme_module.id_map["kf"]))
+        + list(itervalues(enzyme_module.id_map["kr"]))))
+    return ligands + rateconsts + [enzyme_module.enzyme_total_symbol_str]
+
+
+def equation_argument_values(enzyme_module, concentrations,
+                             enzyme_total=None):
+    """Return values for compiled equations in the fixed argument order.
+
+    Concentrations and the enzyme total may be arrays to evaluate many
+    samples at once. The enzyme total defaults to the module's total.
+    """
+    if enzyme_total is None:
+        enzyme_total = enzyme_module.enzyme_concentration_total
+    values = dict(enzyme_module._get_all_parameters())
+    values.update(concentrations)
+    values[enzyme_module.enzyme_total_symbol_str] = enzyme_total
+    return [values[arg] for arg in equation_arguments(enzyme_module)]
+
+
+def sympify_equation(enzyme_module, equation_str):
+    """Sympify a fixed equation string, leaving all variables symbolic."""
+    return sym.sympify(equation_str, locals={
+        arg: sym.Symbol(arg) for arg in equation_arguments(enzyme_module)})
+
+
+def lambdify_equation(enzyme_module, equation):
+    """Compile a symbolic equation into a function of the equation arguments.
+    """
+    return sym.lambdify(
+        [sym.Symbol(arg) for arg in equation_arguments(enzyme_module)],
+        equation, modules="numpy")
+
+
+def substitute_parameters(enzyme_module, equation):
+    """Substitute numerical parameter values into a symbolic equation."""
+    return equation.xreplace({
+        sym.Symbol(pid): value
+        for pid, value in iteritems(enzyme_module._get_all_parameters())
+        if value is not None})
+
+
+def equation_cache_key(enzyme_module, equation_chunks, kind):
+    """Return a cache key for a raw equation and the module ID map.
+
+    The raw equation is either a string or an iterable of string chunks.
+    """
+    if isinstance(equation_chunks, string_types):
+        equation_chunks = [equation_chunks]
+    key = hashlib.sha256()
+    for chunk in equation_chunks:
+        key.update(chunk.encode())
+    key.update(json.dumps(enzyme_module.id_map, sort_keys=True).encode())
+    # Pickled expressions and marshalled code depend on the versions used
+    key.update("|".join((kind, sys.version, sym.__version__)).encode())
+    return key.hexdigest()
+
+
+def read_equation_cache(cache_dir, key):
+    """Return a cached value, or None if the key is not in the cache.
+
+    Entries that cannot be loaded are removed and treated as missing.
+    """
+    filepath = make_path(cache_dir, key + ".pickle")
+    try:
+        with open(filepath, "rb") as f:
+            value = pickle.load(f)
+    except (IOError, OSError):
+        return None
+    except Exception:
+        # Corrupt entries or entries pickled with other package versions
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+        return None
+    # Mark entry as recently used for eviction
+    os.utime(filepath, None)
+    return value
+
+
+def write_equation_cache(cache_dir, key, value,
+                         max_size=EQUATION_CACHE_MAX_SIZE):
+    """Store a value in the cache and evict entries beyond the maximum size.
+
+    The size of the cache is read from disk on the first write to it in a
+    process and again after ``EQUATION_CACHE_REFRESH_FRACTION`` of the
+    maximum size has been written, so processes sharing a cache also count
+    the entries written by the others.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    filepath = make_path(cache_dir, key + ".pickle")
+    # Write to a temporary file first so readers never see partial entries
+    tmp_filepath = "{0}.{1:d}.tmp".format(filepath, os.getpid())
+    with open(tmp_filepath, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filepath, filepath)
+
+    cache_dir = make_path(cache_dir)
+    entry_size = os.path.getsize(filepath)
+    size, written = equation_cache_sizes.get(cache_dir, (None, 0))
+    written += entry_size
+    if size is None or written > max_size * EQUATION_CACHE_REFRESH_FRACTION:
+        size, written = equation_cache_size(cache_dir), 0
+    else:
+        # Overwritten entries are counted twice until the size is read again
+        size += entry_size
+    if size > max_size:
+        size, written = prune_equation_cache(
+            cache_dir, int(max_size * EQUATION_CACHE_PRUNE_FRACTION)), 0
+    equation_cache_sizes[cache_dir] = (size, written)
+
+
+def equation_cache_entries(cache_dir):
+    """Return the modification time, size and filename of cache entries."""
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith(".pickle"):
+            continue
+        try:
+            stat = os.stat(make_path(cache_dir, filename))
+        except OSError:
+            # Entry removed by another process sharing the cache
+            continue
+        entries.append((stat.st_mtime, stat.st_size, filename))
+    return entries
+
+
+def equation_cache_size(cache_dir):
+    """Return the total size in bytes of the entries in a cache."""
+    return sum(size for _, size, _ in equation_cache_entries(cache_dir))
+
+
+def prune_equation_cache(cache_dir, max_size=EQUATION_CACHE_MAX_SIZE):
+    """Remove least recently used cache entries until under the maximum size.
+
+    Returns the total size in bytes of the remaining entries.
+    """
+    total_size = 0
+    remaining_size = 0
+    for _, size, filename in sorted(
+            equation_cache_entries(cache_dir), reverse=True):
+        total_size += size
+        if total_size > max_size:
+            try:
+                os.remove(make_path(cache_dir, filename))
+            except OSError:
+                pass
+        else:
+            remaining_size = total_size
+    return remaining_size
+
+
+def parse_equation_file(enzyme_module, filepath, cache_dir=None):
+    """Parse a raw equation file, streaming it instead of reading it whole.
+    """
+    return parse_equation_chunks(
+        enzyme_module, lambda: iter_equation_file(filepath), cache_dir)
+
+
+def parse_equation_chunks(enzyme_module, read_chunks, cache_dir=None):
+    """Parse a raw equation given in chunks, using a cache if provided.
+
+    ``read_chunks`` returns a new iterable of the raw equation chunks each
+    time it is called, so that the equation can be hashed and then parsed.
+    """
+    if cache_dir is not None:
+        key = equation_cache_key(enzyme_module, read_chunks(), "expr")
+        equation = read_equation_cache(cache_dir, key)
+        if equation is not None:
+            return equation
+
+    equation = build_equation(
+        iter_equation_tokens(enzyme_module, read_chunks()))
+    if cache_dir is not None:
+        write_equation_cache(cache_dir, key, equation)
+    return equation
+
+
+def compile_equation_file(enzyme_module, filepath, cache_dir=None):
+    """Return a compiled function of a raw equation file."""
+    return compile_equation_chunks(
+        enzyme_module, lambda: iter_equation_file(filepath), cache_dir)
+
+
+def compile_equation_chunks(enzyme_module, read_chunks, cache_dir=None):
+    """Return a compiled function of a raw equation given in chunks.
+
+    When a cache is provided, the bytecode of the lambdified function is
+    stored so that later calls skip parsing and code generation entirely.
+    The number of nodes of the equation is kept as the ``nodes`` attribute
+    of the function.
+    """
+    if cache_dir is not None:
+        key = equation_cache_key(enzyme_module, read_chunks(), "code_nodes")
+        cached = read_equation_cache(cache_dir, key)
+        if cached is not None:
+            code, nodes = marshal.loads(cached)
+            func = types.FunctionType(
+                code, {"numpy": np}, "_lambdifygenerated")
+            func.nodes = nodes
+            return func
+
+    equation = parse_equation_chunks(enzyme_module, read_chunks, cache_dir)
+    func = lambdify_equation(enzyme_module, equation)
+    func.nodes = count_nodes(equation)
+    if cache_dir is not None:
+        write_equation_cache(
+            cache_dir, key, marshal.dumps((func.__code__, func.nodes)))
+    return func
+
+
+def enzyme_total_coefficients(enzyme_module, rate_equation=None):
+    """Return the offset and coefficient of the rate law in the enzyme total.
+
+    The rate law is expressed as ``offset + coefficient * enzyme_total``.
+    None is returned if the rate law is not linear in the enzyme total. The
+    rate law defaults to the enzyme rate equation of the module.
+    """
+    e_total = sym.Symbol(enzyme_module.enzyme_total_symbol_str)
+    if rate_equation is None:
+        rate_equation = enzyme_module.enzyme_rate_equation
+    # Rate laws are sums of products with the enzyme total as a factor
+    offset, coefficient = [], []
+    for term in sym.Add.make_args(rate_equation):
+        independent, dependent = term.as_independent(e_total, as_Add=False)
+        if dependent == e_total:
+            coefficient.append(independent)
+        elif dependent == 1:
+            offset.append(term)
+        else:
+            break
+    else:
+        return sym.Add(*offset), sym.Add(*coefficient)
+
+    coefficient = rate_equation.diff(e_total)
+    if e_total in coefficient.free_symbols:
+        return None
+    return rate_equation.xreplace({e_total: 0}), coefficient
+
+
+def enzyme_module_arguments(enzyme_module):
+    """Return the fixed argument order used by compiled enzyme modules.
+
+    Arguments are the same as for compiled equations, except that the enzyme
+    flux takes the place of the enzyme total.
+    """
+    return equation_arguments(enzyme_module)[:-1] + [
+        enzyme_module.enzyme_flux_symbol_str]
+
+
+def enzyme_module_argument_values(enzyme_module, concentrations,
+                                  steady_state_flux):
+    """Return values for compiled enzyme modules in the fixed argument order.
+
+    Concentrations, rate constants and the flux may be arrays to evaluate
+    many samples at once.
+    """
+    values = dict(enzyme_module._get_all_parameters())
+    values.update(concentrations)
+    values[enzyme_module.enzyme_flux_symbol_str] = steady_state_flux
+    return [values[arg] for arg in enzyme_module_arguments(enzyme_module)]
+
+
+def compile_enzyme_module(enzyme_module, path_to_dir, cache_dir=None):
+    """Return one compiled function for the enzyme total and all its forms.
+
+    Common subexpressions of the rate law and the enzyme module form
+    equations are eliminated together, so that shared denominators are only
+    evaluated once. The function takes the ``enzyme_module_arguments`` and
+    returns the enzyme total followed by the enzyme module form
+    concentrations, in the order of the returned enzyme module form IDs.
+    """
+    forms = [
+        (old_specie, specie)
+        for old_specie, specie in iteritems(enzyme_module.id_map["species"])
+        if specie in enzyme_module.enzyme_module_forms]
+    filepaths = [
+        path_to_enzyme_file(path_to_dir, enzyme_module.id, type_str)
+        for type_str in ["rateLaw"] + [
+            "equation_" + old_specie for old_specie, _ in forms]]
+    forms = [specie for _, specie in forms]
+
+    if cache_dir is not None:
+        key = equation_cache_key(enzyme_module, chain.from_iterable(
+            chain([os.path.basename(filepath)], iter_equation_file(filepath))
+            for filepath in filepaths), "module_code")
+        code = read_equation_cache(cache_dir, key)
+        if code is not None:
+            return types.FunctionType(
+                marshal.loads(code), {"numpy": np},
+                "_lambdifygenerated"), forms
+
+    rate_law = parse_equation_file(enzyme_module, filepaths[0], cache_dir)
+    coefficients = enzyme_total_coefficients(enzyme_module, rate_law)
+    if coefficients is None:
+        raise ValueError(
+            "Rate law for '{0}' is not linear in the enzyme total.".format(
+                enzyme_module.id))
+    # Solve the linear rate law for the enzyme total
+    offset, coefficient = coefficients
+    e_total = (sym.Symbol(enzyme_module.enzyme_flux_symbol_str)
+               - offset) / coefficient
+    equations = [e_total] + [
+        parse_equation_file(enzyme_module, filepath, cache_dir).xreplace(
+            {sym.Symbol(enzyme_module.enzyme_total_symbol_str): e_total})
+        for filepath in filepaths[1:]]
+
+    func = sym.lambdify(
+        [sym.Symbol(arg) for arg in enzyme_module_arguments(enzyme_module)],
+        equations, modules="numpy", cse=True)
+    if cache_dir is not None:
+        write_equation_cache(cache_dir, key, marshal.dumps(func.__code__))
+    return func, forms
 
 
 def calculate_enzyme_total(enzyme_module, concentrations, steady_state_flux):
     """Calculate the total amount of enzyme necessary to sustain given flux."""
+    coefficients = enzyme_total_coefficients(enzyme_module)
+    if coefficients is not None:
+        # Solve the linear rate law directly
+        concentrations = {
+            sym.Symbol(mid): ic for mid, ic in iteritems(concentrations)}
+        offset, coefficient = [
+            float(c.xreplace(concentrations)) for c in coefficients]
+        return (steady_state_flux - offset) / coefficient
+
     rate_eq = sym.Eq(
         enzyme_module.enzyme_rate_equation.subs(concentrations),
         steady_state_flux)
@@ -72,48 +673,336 @@ def calculate_enzyme_total(enzyme_module, concentrations, steady_state_flux):
     return e_total
 
 
-def make_enzyme_module_from_dir(enzyme_id, steady_state_flux=None,
-                                metabolite_concentrations=None,
-                                path_to_dir=None, **kwargs):
-    """Create an enzyme module from a directory of text files."""
+def clip_form_concentrations(form_concentrations, enzyme_total, zero_tol,
+                             rtol=1e-6):
+    """Zero enzyme module form concentrations within tolerance of zero.
+
+    All forms are clipped together. Concentrations and the enzyme total may
+    be scalars or arrays with one value per sample. Returns the clipped
+    concentrations and a DataFrame reporting, for each form, the number of
+    values clipped, the largest magnitude clipped, the smallest value and
+    the number of values that are not finite. Warnings are issued if the
+    unclipped forms do not sum to the enzyme total within the relative
+    tolerance ``rtol``, if any form remains negative or is not finite.
+    """
+    forms = list(form_concentrations)
+    values = np.array(np.broadcast_arrays(
+        enzyme_total, *[form_concentrations[f] for f in forms]), dtype=float)
+    enzyme_total, values = values[0], values[1:]
+    finite = np.isfinite(values)
+    clipped = np.abs(values) <= zero_tol
+    flat_values = np.where(finite, values, np.nan).reshape(len(forms), -1)
+    flat_clipped = clipped.reshape(len(forms), -1)
+    report = pd.DataFrame({
+        "clipped": flat_clipped.sum(axis=1),
+        "max_clipped": np.where(
+            flat_clipped, np.abs(flat_values), 0).max(axis=1, initial=0),
+        "min_value": np.fmin.reduce(flat_values, axis=1, initial=np.inf),
+        "non_finite": (~finite).reshape(len(forms), -1).sum(axis=1)},
+        index=pd.Index(forms, name="form"))
+
+    # Forms are conserved, so they must add up to the enzyme total before
+    # clipping; samples that are not finite are reported separately.
+    with np.errstate(invalid="ignore"):
+        error = np.abs(values.sum(axis=0) - enzyme_total)
+        error = np.where(
+            enzyme_total != 0, error / np.abs(enzyme_total), error)
+    error = error[np.isfinite(error)]
+    if error.size and np.max(error) > rtol:
+        warnings.warn(
+            "Enzyme module forms differ from the enzyme total by a relative "
+            "error of up to {0:.3g}.".format(np.max(error)))
+    negative = [f for f, v in zip(forms, flat_values)
+                if np.any(v < -zero_tol)]
+    if negative:
+        warnings.warn(
+            "Negative concentrations larger than the zero tolerance for "
+            "enzyme module forms: {0}".format(", ".join(negative)))
+    non_finite = report.index[report["non_finite"] > 0]
+    if len(non_finite):
+        warnings.warn(
+            "Concentrations that are not finite for enzyme module forms: "
+            "{0}".format(", ".join(non_finite)))
+    values[clipped] = 0
+
+    return dict(zip(forms, values)), report
+
+
+def path_to_enzyme_file(path_to_dir, enzyme_id, type_str):
+    """Return filepath to an enzyme data file.
+
+    If the enzyme data has been packed into a single file that is newer
+    than the files of the enzyme directory, the returned path points to a
+    file inside of the packed file.
+    """
+    bundle_path = os.path.join(path_to_dir, enzyme_id + ENZYME_DATA_BUNDLE_EXT)
+    enzyme_dir = os.path.join(path_to_dir, enzyme_id)
+    if is_enzyme_data_bundle_current(bundle_path, enzyme_dir):
+        enzyme_dir = bundle_path
+        filenames = read_enzyme_data_bundle(bundle_path)
+    else:
+        filenames = os.listdir(enzyme_dir)
+    filename = "_".join((type_str, enzyme_id.lower()))
+    if filename + ".txt" in filenames:
+        filename += ".txt"
+    return os.path.join(enzyme_dir, filename)
+
+
+def is_enzyme_data_bundle_current(bundle_path, enzyme_dir):
+    """Return whether packed enzyme data exist and are newer than the files.
+
+    The enzyme directory is only scanned once for each version of the packed
+    file, so files changed afterwards are noticed when the data are packed
+    again or in a new session. A warning is issued if files in the enzyme
+    directory have been changed since the data were packed.
+    """
+    if not os.path.isfile(bundle_path):
+        return False
+    bundle_mtime = os.path.getmtime(bundle_path)
+    checked = enzyme_data_bundle_checks.get(bundle_path, (None, None))
+    if checked[0] == bundle_mtime:
+        return checked[1]
+
+    current = True
+    if os.path.isdir(enzyme_dir):
+        dir_mtime = max(chain(
+            [os.path.getmtime(enzyme_dir)],
+            (entry.stat().st_mtime for entry in os.scandir(enzyme_dir))))
+        if dir_mtime > bundle_mtime:
+            warnings.warn(
+                "{0} is older than the files in {1}, reading the files "
+                "instead. Pack the enzyme data again to use the packed "
+                "file.".format(bundle_path, enzyme_dir))
+            current = False
+    enzyme_data_bundle_checks[bundle_path] = (bundle_mtime, current)
+    return current
+
+
+def read_enzyme_data_bundle(bundle_path):
+    """Return the contents of a packed enzyme data file, loading it once.
+
+    Only the ``ENZYME_DATA_BUNDLE_CACHE_SIZE`` most recently used packed
+    files are kept in memory.
+    """
+    mtime = os.path.getmtime(bundle_path)
+    cached = enzyme_data_bundles.pop(bundle_path, (None, None))
+    if cached[0] != mtime:
+        with np.load(bundle_path, allow_pickle=False) as data:
+            cached = (mtime, {name: data[name] for name in data.files})
+    # Reinsert as the most recently used and evict the least recently used
+    enzyme_data_bundles[bundle_path] = cached
+    while len(enzyme_data_bundles) > ENZYME_DATA_BUNDLE_CACHE_SIZE:
+        del enzyme_data_bundles[next(iter(enzyme_data_bundles))]
+    return cached[1]
+
+
+def open_enzyme_file(filepath):
+    """Open an enzyme data file for reading, including packed data files.
+
+    Files inside of a packed file are decoded whole into memory, so unlike
+    files in an enzyme directory, their equations are not streamed.
+    """
+    bundle_path, filename = os.path.split(filepath)
+    if bundle_path.endswith(ENZYME_DATA_BUNDLE_EXT) \
+       and os.path.isfile(bundle_path):
+        contents = read_enzyme_data_bundle(bundle_path)[filename]
+        return io.StringIO(contents.tobytes().decode(), newline=None)
+    return open(filepath, "r")
+
+
+def parse_rateconst_clusters(lines, n_columns=None):
+    """Parse Mathematica formatted rate constant clusters into an array.
+
+    Every non-empty line is one cluster written as ``{value, value, ...}``,
+    where values may use ``*^`` for exponents. A ValueError with the line and
+    column of the first malformed value is raised, as well as for clusters
+    without ``n_columns`` values if given, or without as many values as the
+    first cluster otherwise, and if there are no clusters at all.
+    """
+    clusters = []
+    for line_number, line in enumerate(lines, 1):
+        text = line.strip()
+        if not text:
+            continue
+        column = line.index(text[0]) + 1
+        if not (text.startswith("{") and text.endswith("}")):
+            raise ValueError(
+                "Line {0:d}, column {1:d}: rate constant cluster must be "
+                "enclosed in braces.".format(line_number, column))
+        try:
+            cluster = np.array(
+                text[1:-1].replace("*^", "e").split(","), dtype=float)
+        except ValueError:
+            cluster = None
+        if cluster is None or not np.isfinite(cluster).all():
+            # Find the malformed value to report its position
+            column += 1
+            for value in text[1:-1].split(","):
+                try:
+                    valid = np.isfinite(float(value.replace("*^", "e")))
+                except ValueError:
+                    valid = False
+                if not valid:
+                    raise ValueError(
+                        "Line {0:d}, column {1:d}: invalid rate constant "
+                        "value '{2}'.".format(
+                            line_number,
+                            column + len(value) - len(value.lstrip()),
+                            value.strip()))
+                column += len(value) + 1
+        if n_columns is None:
+            n_columns = len(cluster)
+        if len(cluster) != n_columns:
+            raise ValueError(
+                "Line {0:d}: expected {1:d} rate constant values, found "
+                "{2:d}.".format(line_number, n_columns, len(cluster)))
+        clusters.append(cluster)
+    if not clusters:
+        raise ValueError("no rate constant clusters found.")
+    return np.array(clusters, dtype=float)
+
+
+def read_rateconst_clusters(labels_filepath, clusters_filepath):
+    """Return the rate constant labels and clusters from text files.
+
+    The clusters are a float array with one row per cluster and one column
+    per label. Packed enzyme data use the clusters parsed when packing.
+    """
+    with open_enzyme_file(labels_filepath) as f:
+        rateconst_labels = [l.strip() for l in f.readlines() if l.strip()]
+
+    bundle_path = os.path.dirname(clusters_filepath)
+    if bundle_path.endswith(ENZYME_DATA_BUNDLE_EXT) \
+       and os.path.isfile(bundle_path) \
+       and "rateconst_clusters" in read_enzyme_data_bundle(bundle_path):
+        rateconst_clusters = read_enzyme_data_bundle(
+            bundle_path)["rateconst_clusters"]
+        if rateconst_clusters.shape[1] != len(rateconst_labels):
+            raise ValueError(
+                "{0}: expected {1:d} rate constant values, found {2:d}."
+                .format(os.path.basename(clusters_filepath),
+                        len(rateconst_labels), rateconst_clusters.shape[1]))
+        return rateconst_labels, rateconst_clusters
+
+    with open_enzyme_file(clusters_filepath) as f:
+        try:
+            rateconst_clusters = parse_rateconst_clusters(
+                f.readlines(), len(rateconst_labels))
+        except ValueError as e:
+            raise ValueError("{0}: {1}".format(
+                os.path.basename(clusters_filepath), e))
+    return rateconst_labels, rateconst_clusters
+
+
+def pack_enzyme_module_data(enzyme_id, path_to_dir, bundle_path=None):
+    """Pack the data files of an enzyme directory into a single file.
+
+    The raw contents of every file are stored along with the rate constant
+    clusters as a float array under the ``rateconst_clusters`` key. By
+    default the packed file is written next to the enzyme directory, where
+    :func:`make_enzyme_module_from_dir` will use it in place of the
+    directory until files in the directory are changed. Returns the path to
+    the packed file.
+    """
+    enzyme_dir = os.path.join(path_to_dir, enzyme_id)
+    if bundle_path is None:
+        bundle_path = os.path.join(
+            path_to_dir, enzyme_id + ENZYME_DATA_BUNDLE_EXT)
+    contents = {}
+    for filename in sorted(os.listdir(enzyme_dir)):
+        with open(os.path.join(enzyme_dir, filename), "rb") as f:
+            contents[filename] = np.frombuffer(f.read(), dtype=np.uint8)
+
+    filename = "_".join(("rateconst_clusters", enzyme_id.lower()))
+    if filename + ".txt" in contents:
+        filename += ".txt"
+    try:
+        contents["rateconst_clusters"] = parse_rateconst_clusters(
+            contents[filename].tobytes().decode().splitlines())
+    except ValueError as e:
+        raise ValueError("{0}: {1}".format(filename, e))
+    np.savez_compressed(bundle_path, **contents)
+
+    return bundle_path
+
+
+def make_enzyme_module_structure_from_dir(enzyme_id, path_to_dir=None,
+                                          **kwargs):
+    """Create an enzyme module without steady state values from a directory.
+
+    The returned module keeps the temporary ``id_map`` attribute so that the
+    equations for the enzyme module forms can still be read.
+    """
+    profile = kwargs.get("profile", None)
+    # Read and validate rate constants before building any objects
+    filepath = path_to_enzyme_file(
+        path_to_dir, enzyme_id, "rateconst_clusters")
+    with profile_stage(profile, "rateconst_clusters", filepath):
+        rateconst_labels, rateconst_clusters = read_rateconst_clusters(
+            path_to_enzyme_file(path_to_dir, enzyme_id, "rateconst_labels"),
+            filepath)
+
     enzyme_module = EnzymeModule(enzyme_id)
     # Add temporary attribute to track ID mapping changes
     enzyme_module.id_map = {}
-    # Set flux through enzyme
-    enzyme_module.enzyme_rate = steady_state_flux
-
-    def path_to_enzyme_file(type_str):
-        """Return filepath to an enzyme data file."""
-        enzyme_dir = os.path.join(path_to_dir, enzyme_module.id)
-        filename = "_".join((type_str, enzyme_module.id.lower()))
-        if filename + ".txt" in os.listdir(enzyme_dir):
-            filename += ".txt"
-        return os.path.join(enzyme_dir, filename)
 
     # Make species and add to model
-    metabolites_from_txt(enzyme_module, path_to_enzyme_file("species"))
+    filepath = path_to_enzyme_file(path_to_dir, enzyme_id, "species")
+    with profile_stage(profile, "species", filepath):
+        metabolites_from_txt(enzyme_module, filepath)
 
     # Make reactions and add to model
-    reactions_from_txt(enzyme_module, path_to_enzyme_file("reactions"))
+    filepath = path_to_enzyme_file(path_to_dir, enzyme_id, "reactions")
+    with profile_stage(profile, "reactions", filepath):
+        reactions_from_txt(enzyme_module, filepath)
 
     # Set GPR if given.
     if kwargs.get("enzyme_gpr", None) is not None:
         for reaction in enzyme_module.enzyme_module_reactions:
             reaction.gene_reaction_rule = kwargs.get("enzyme_gpr", None)
     # Determine rate constant values and add to model
-    rateconsts_from_txt(enzyme_module, kwargs.get("kcluster", 1),
-                        path_to_enzyme_file("rateconst_labels"),
-                        path_to_enzyme_file("rateconst_clusters"))
+    with profile_stage(profile, "rateconsts"):
+        rateconsts_from_clusters(
+            enzyme_module, kwargs.get("kcluster", 1), rateconst_labels,
+            rateconst_clusters)
     # Set rate law equation for flux through enzyme.
-    kinetic_rate_law_from_txt(enzyme_module, path_to_enzyme_file("rateLaw"))
+    filepath = path_to_enzyme_file(path_to_dir, enzyme_id, "rateLaw")
+    with profile_stage(profile, "rate_law", filepath) as record:
+        kinetic_rate_law_from_txt(
+            enzyme_module, filepath, cache_dir=kwargs.get("cache_dir", None))
+        record["expression"] = enzyme_module.enzyme_rate_equation
+
+    return enzyme_module
+
+
+def make_enzyme_module_from_dir(enzyme_id, steady_state_flux=None,
+                                metabolite_concentrations=None,
+                                path_to_dir=None, **kwargs):
+    """Create an enzyme module from a directory of text files.
+
+    Pass a list as ``profile`` to record the wall time, peak memory and
+    expression size of every construction stage and enzyme module form file,
+    see ``profile_report``. Pass a list as ``clip_reports`` to receive the
+    report of the enzyme module forms clipped to zero, see
+    ``clip_form_concentrations``.
+    """
+    profile = kwargs.get("profile", None)
+    enzyme_module = make_enzyme_module_structure_from_dir(
+        enzyme_id, path_to_dir, **kwargs)
+    # Set flux through enzyme
+    enzyme_module.enzyme_rate = steady_state_flux
+
     # Calculate the expected total amount of enzyme based on the enzyme flux
     metabolite_concentrations = {
-        m.id: ic for m, ic in iteritems(metabolite_concentrations)
-        if m.id in enzyme_module.metabolites}
-    enzyme_module.enzyme_concentration_total = calculate_enzyme_total(
-        enzyme_module, metabolite_concentrations, steady_state_flux)
+        getattr(m, "id", m): ic for m, ic in iteritems(
+            metabolite_concentrations)
+        if getattr(m, "id", m) in enzyme_module.metabolites}
+    with profile_stage(profile, "enzyme_total"):
+        enzyme_module.enzyme_concentration_total = calculate_enzyme_total(
+            enzyme_module, metabolite_concentrations, steady_state_flux)
 
     # Get steady state concentrations for enzyme module forms
+    forms = []
     for old_specie, specie in iteritems(enzyme_module.id_map["species"]):
         try:
             specie = enzyme_module.enzyme_module_forms.get_by_id(specie)
@@ -121,13 +1010,28 @@ def make_enzyme_module_from_dir(enzyme_id, steady_state_flux=None,
             specie = enzyme_module.metabolites.get_by_id(specie)
             specie.ic = metabolite_concentrations[specie.id]
         else:
-            steady_state_concentrations_from_txt(
-                enzyme_module, path_to_enzyme_file("equation_" + old_specie),
-                specie, metabolite_concentrations,
-                zero_tol=kwargs.get("zero_tol", 1e-15))
+            filepath = path_to_enzyme_file(
+                path_to_dir, enzyme_id, "equation_" + old_specie)
+            with profile_stage(profile, "form", filepath) as record:
+                # Forms are clipped together once all are evaluated
+                record["expression"] = steady_state_concentrations_from_txt(
+                    enzyme_module, filepath, specie,
+                    metabolite_concentrations, zero_tol=0,
+                    compiled=kwargs.get("compiled", False),
+                    cache_dir=kwargs.get("cache_dir", None))
             specie._repair_bound_obj_pointers()
             specie.generate_form_formula(update_enzyme=True)
             specie.generate_form_charge(update_enzyme=True)
+            forms.append(specie)
+
+    form_concentrations, report = clip_form_concentrations(
+        {specie.id: specie.ic for specie in forms},
+        enzyme_module.enzyme_concentration_total,
+        kwargs.get("zero_tol", 1e-15))
+    for specie in forms:
+        specie.ic = float(form_concentrations[specie.id])
+    if kwargs.get("clip_reports", None) is not None:
+        kwargs.get("clip_reports").append(report)
 
     # Remove ID map before returning module
     del enzyme_module.id_map
@@ -135,13 +1039,358 @@ def make_enzyme_module_from_dir(enzyme_id, steady_state_flux=None,
     return enzyme_module
 
 
+class EnzymeModuleTemplate(object):
+    """Enzyme module structure built once and instantiated with new values.
+
+    The structure of the enzyme module is made from the directory once, and
+    the enzyme total and enzyme module form equations are compiled into one
+    function. Enzyme modules for a steady state flux and metabolite
+    concentrations are then made by copying the structure and evaluating
+    the compiled function, for any of the rate constant clusters.
+    """
+
+    def __init__(self, enzyme_id, path_to_dir=None, **kwargs):
+        """Initialize the template from a directory of text files."""
+        self.kcluster = kwargs.get("kcluster", 1)
+        self.zero_tol = kwargs.get("zero_tol", 1e-15)
+        self.clip_reports = kwargs.get("clip_reports", None)
+        enzyme_module = make_enzyme_module_structure_from_dir(
+            enzyme_id, path_to_dir, **kwargs)
+        with profile_stage(kwargs.get("profile", None), "compile"):
+            self._function, self.enzyme_module_forms = compile_enzyme_module(
+                enzyme_module, path_to_dir, kwargs.get("cache_dir", None))
+        self._arguments = enzyme_module_arguments(enzyme_module)
+        self._parameters = enzyme_module._get_all_parameters()
+        # Keep the rate law without values to substitute other clusters
+        self._rate_law = parse_equation_file(
+            enzyme_module,
+            path_to_enzyme_file(path_to_dir, enzyme_id, "rateLaw"),
+            kwargs.get("cache_dir", None))
+        self._rateconst_clusters = rateconst_cluster_values(
+            enzyme_module,
+            path_to_enzyme_file(path_to_dir, enzyme_id, "rateconst_labels"),
+            path_to_enzyme_file(path_to_dir, enzyme_id, "rateconst_clusters"))
+        self.ligands = [
+            m.id for m in enzyme_module.metabolites
+            if not isinstance(m, EnzymeModuleForm)]
+
+        # Structural updates shared by all enzyme modules
+        for specie in self.enzyme_module_forms:
+            specie = enzyme_module.enzyme_module_forms.get_by_id(specie)
+            specie._repair_bound_obj_pointers()
+            specie.generate_form_formula(update_enzyme=True)
+            specie.generate_form_charge(update_enzyme=True)
+
+        # Remove ID map before copying module
+        del enzyme_module.id_map
+        self.enzyme_module = enzyme_module
+
+    def rateconsts(self, kcluster=None):
+        """Return the rate constant values of a cluster.
+
+        Defaults to the cluster the template was made with.
+        """
+        if kcluster is None:
+            kcluster = self.kcluster
+        n_clusters = len(next(itervalues(self._rateconst_clusters)))
+        if not 1 <= kcluster <= n_clusters:
+            raise IndexError(
+                "Invalid kcluster. Must be an int between [1, {}], ".format(
+                    int(n_clusters)))
+        return {
+            rateconst: float(values[kcluster - 1])
+            for rateconst, values in iteritems(self._rateconst_clusters)}
+
+    def evaluate(self, steady_state_flux, concentrations, kcluster=None):
+        """Return the enzyme total and the enzyme module form concentrations.
+
+        Concentrations are keyed by metabolite or ID. The flux and the
+        concentrations may be arrays to evaluate many samples at once.
+        """
+        results = self._evaluate(steady_state_flux, concentrations, kcluster)
+        return results[0], self._form_concentrations(results[0], results[1:])
+
+    def evaluate_fluxes(self, steady_state_fluxes, concentrations,
+                        kcluster=None):
+        """Return the enzyme totals and form concentrations for many fluxes.
+
+        The enzyme total and the form concentrations are linear in the flux,
+        so they are only evaluated at fluxes of zero and one and scaled to
+        every flux for the given concentrations.
+        """
+        steady_state_fluxes = np.asarray(steady_state_fluxes, dtype=float)
+        results = [
+            np.broadcast_to(result, (2,))
+            for result in self._evaluate(
+                np.array([0., 1.]), concentrations, kcluster)]
+        results = [
+            result[0] + steady_state_fluxes * (result[1] - result[0])
+            for result in results]
+        return results[0], self._form_concentrations(results[0], results[1:])
+
+    def _evaluate(self, steady_state_flux, concentrations, kcluster=None):
+        """Return the results of the compiled function."""
+        values = dict(self._parameters)
+        values.update(self.rateconsts(kcluster))
+        values.update({
+            getattr(m, "id", m): ic for m, ic in iteritems(concentrations)})
+        values[self.enzyme_module.enzyme_flux_symbol_str] = steady_state_flux
+        return self._function(*[values[arg] for arg in self._arguments])
+
+    def _form_concentrations(self, enzyme_total, results):
+        """Return form concentrations with values within tolerance zeroed."""
+        form_concentrations, report = clip_form_concentrations(
+            dict(zip(self.enzyme_module_forms, results)), enzyme_total,
+            self.zero_tol)
+        if self.clip_reports is not None:
+            self.clip_reports.append(report)
+        return form_concentrations
+
+    def instantiate(self, steady_state_flux, concentrations, kcluster=None):
+        """Return a new enzyme module for a flux and metabolite concentrations.
+        """
+        concentrations = {
+            getattr(m, "id", m): ic for m, ic in iteritems(concentrations)
+            if getattr(m, "id", m) in self.ligands}
+        enzyme_total, form_concentrations = self.evaluate(
+            steady_state_flux, concentrations, kcluster)
+        concentrations.update(form_concentrations)
+        return self._copy_with_values(
+            steady_state_flux, enzyme_total, concentrations, kcluster)
+
+    def instantiate_many(self, steady_state_fluxes, metabolite_concentrations,
+                         kcluster=None):
+        """Return one enzyme module per concentration sample.
+
+        ``metabolite_concentrations`` is a DataFrame (or list of dicts) with
+        one row per sample and one column per metabolite, and
+        ``steady_state_fluxes`` is either one flux per sample or a single
+        flux shared by all samples. All samples are evaluated together.
+        """
+        metabolite_concentrations = pd.DataFrame(metabolite_concentrations)
+        metabolite_concentrations.columns = [
+            getattr(mid, "id", mid)
+            for mid in metabolite_concentrations.columns]
+        n_samples = len(metabolite_concentrations.index)
+        steady_state_fluxes = np.broadcast_to(
+            np.asarray(steady_state_fluxes, dtype=float), (n_samples,))
+        concentrations = {
+            mid: metabolite_concentrations[mid].values
+            for mid in self.ligands}
+        enzyme_totals, form_concentrations = self.evaluate(
+            steady_state_fluxes, concentrations, kcluster)
+        concentrations.update(form_concentrations)
+        enzyme_totals = np.broadcast_to(enzyme_totals, (n_samples,))
+        concentrations = {
+            mid: np.broadcast_to(values, (n_samples,))
+            for mid, values in iteritems(concentrations)}
+
+        return [
+            self._copy_with_values(
+                steady_state_fluxes[i], enzyme_totals[i],
+                {mid: values[i] for mid, values in iteritems(concentrations)},
+                kcluster)
+            for i in range(n_samples)]
+
+    def _copy_with_values(self, steady_state_flux, enzyme_total,
+                          concentrations, kcluster=None):
+        """Copy the enzyme module structure and set its values."""
+        enzyme_module = self.enzyme_module.copy()
+        if kcluster is not None and kcluster != self.kcluster:
+            enzyme_module.update_parameters(self.rateconsts(kcluster))
+            enzyme_module.enzyme_rate_equation = substitute_parameters(
+                enzyme_module, self._rate_law)
+        enzyme_module.enzyme_rate = float(steady_state_flux)
+        enzyme_module.enzyme_concentration_total = float(enzyme_total)
+        for mid, ic in iteritems(concentrations):
+            enzyme_module.metabolites.get_by_id(mid).ic = float(ic)
+        return enzyme_module
+
+
+def sweep_isozyme_flux_splits(isozyme_templates, steady_state_flux,
+                              metabolite_concentrations, flux_splits,
+                              kcluster=None):
+    """Return enzyme totals and form concentrations over isozyme flux splits.
+
+    ``isozyme_templates`` maps isozyme IDs to their ``EnzymeModuleTemplate``
+    and ``flux_splits`` maps isozyme IDs to the fraction of the flux through
+    the isozyme at every point of the sweep, for example::
+
+        splits = np.linspace(0, 1, 101)
+        flux_splits = {"PFK1": splits, "PFK2": 1 - splits}
+
+    Returns a dict of isozyme IDs to the enzyme totals and the form
+    concentrations at every point, evaluating each isozyme only once.
+    """
+    return {
+        isozyme: isozyme_templates[isozyme].evaluate_fluxes(
+            steady_state_flux * np.asarray(splits, dtype=float),
+            metabolite_concentrations, kcluster)
+        for isozyme, splits in iteritems(flux_splits)}
+
+
+def make_enzyme_modules_for_ensemble(enzyme_id, steady_state_fluxes,
+                                     metabolite_concentrations,
+                                     path_to_dir=None, **kwargs):
+    """Create one enzyme module per concentration sample from a directory.
+
+    The module structure is built once and every equation is compiled once,
+    then the enzyme totals and enzyme module form concentrations are
+    evaluated for all samples together. ``metabolite_concentrations`` is a
+    DataFrame (or list of dicts) with one row per sample and one column per
+    metabolite, and ``steady_state_fluxes`` is either one flux per sample or
+    a single flux shared by all samples.
+    """
+    template = EnzymeModuleTemplate(enzyme_id, path_to_dir, **kwargs)
+    return template.instantiate_many(
+        steady_state_fluxes, metabolite_concentrations)
+
+
+def rateconst_cluster_values(enzyme_module, labels_filepath,
+                             clusters_filepath):
+    """Return the values of each rate constant for every cluster.
+
+    Values are arrays with one entry per cluster, keyed by the rate constant
+    IDs in the enzyme module.
+    """
+    rateconst_labels, clusters = read_rateconst_clusters(
+        labels_filepath, clusters_filepath)
+
+    rateconst_values = {}
+    for i, rateconst in enumerate(rateconst_labels):
+        key = {"fwd": "kf", "rev": "kr"}[
+            rateconst_re.search(rateconst).group(2)]
+        rateconst_values[enzyme_module.id_map[key][rateconst]] = clusters[:, i]
+    return rateconst_values
+
+
+def sweep_rateconst_clusters(enzyme_id, steady_state_flux,
+                             metabolite_concentrations, path_to_dir=None,
+                             **kwargs):
+    """Evaluate the enzyme module for every rate constant cluster at once.
+
+    The module structure is built once and every equation is compiled once,
+    then the enzyme total and the enzyme module form concentrations are
+    evaluated with the rate constants of all clusters together.
+
+    Returns a tidy DataFrame with the columns ``kcluster``, ``species``,
+    ``concentration`` and ``fraction``, where ``fraction`` is the fraction of
+    the enzyme total. The enzyme total is included as a species.
+    """
+    cache_dir = kwargs.get("cache_dir", None)
+    zero_tol = kwargs.get("zero_tol", 1e-15)
+
+    template = make_enzyme_module_structure_from_dir(
+        enzyme_id, path_to_dir, **kwargs)
+    values = {
+        getattr(m, "id", m): ic for m, ic in iteritems(
+            metabolite_concentrations)
+        if getattr(m, "id", m) in template.metabolites}
+    rateconst_values = rateconst_cluster_values(
+        template,
+        path_to_enzyme_file(path_to_dir, enzyme_id, "rateconst_labels"),
+        path_to_enzyme_file(path_to_dir, enzyme_id, "rateconst_clusters"))
+    values.update(rateconst_values)
+    n_clusters = len(next(itervalues(rateconst_values)))
+
+    # Evaluate the enzyme total and all forms with one compiled function
+    with profile_stage(kwargs.get("profile", None), "compile"):
+        func, forms = compile_enzyme_module(template, path_to_dir, cache_dir)
+    results = [
+        np.array(np.broadcast_to(result, (n_clusters,)), dtype=float)
+        for result in func(*enzyme_module_argument_values(
+            template, values, steady_state_flux))]
+    enzyme_totals, form_values = results[0], results[1:]
+
+    form_concentrations, report = clip_form_concentrations(
+        dict(zip(forms, form_values)), enzyme_totals, zero_tol)
+    if kwargs.get("clip_reports", None) is not None:
+        kwargs.get("clip_reports").append(report)
+
+    columns = {template.enzyme_total_symbol_str: enzyme_totals}
+    columns.update(form_concentrations)
+    sweep = pd.DataFrame(columns)
+    sweep.insert(0, "kcluster", np.arange(1, n_clusters + 1))
+    sweep = sweep.melt(
+        id_vars="kcluster", var_name="species", value_name="concentration")
+    sweep["fraction"] = sweep["concentration"] / np.tile(
+        enzyme_totals, len(forms) + 1)
+    return sweep
+
+
+def enzyme_data_size(enzyme_id, path_to_dir):
+    """Return the total size in bytes of the data files for an enzyme."""
+    bundle_path = os.path.join(path_to_dir, enzyme_id + ENZYME_DATA_BUNDLE_EXT)
+    enzyme_dir = os.path.join(path_to_dir, enzyme_id)
+    if is_enzyme_data_bundle_current(bundle_path, enzyme_dir):
+        return sum(
+            contents.nbytes
+            for contents in itervalues(read_enzyme_data_bundle(bundle_path)))
+    return sum(
+        os.path.getsize(os.path.join(enzyme_dir, filename))
+        for filename in os.listdir(enzyme_dir))
+
+
+def _make_enzyme_module_with_reports(report_keys, **kwargs):
+    """Build an enzyme module and return it with the lists of reports.
+
+    Lists given for ``report_keys`` are filled in the worker process, so
+    new lists are used and returned to be added to the caller's lists.
+    """
+    reports = {key: [] for key in report_keys}
+    kwargs.update(reports)
+    return make_enzyme_module_from_dir(**kwargs), reports
+
+
+def build_enzyme_modules_parallel(enzyme_specs, max_workers=None):
+    """Build enzyme modules from directories in parallel processes.
+
+    Each spec is a dict of keyword arguments for
+    :func:`make_enzyme_module_from_dir`. Enzyme modules are returned in the
+    same order as the specs. The largest enzyme modules are submitted first
+    so that a single large module does not finish long after the rest.
+    Records for ``profile`` and ``clip_reports`` lists in a spec are added
+    to those lists once the enzyme module is built.
+    """
+    report_lists = []
+    enzyme_specs = [dict(spec) for spec in enzyme_specs]
+    for spec in enzyme_specs:
+        # Send metabolite IDs instead of objects tied to a model
+        if spec.get("metabolite_concentrations", None) is not None:
+            spec["metabolite_concentrations"] = {
+                getattr(m, "id", m): ic for m, ic in iteritems(
+                    spec["metabolite_concentrations"])}
+        # Lists appended to in a worker are not seen by the caller
+        report_lists.append({
+            key: spec.pop(key) for key in ["profile", "clip_reports"]
+            if spec.get(key, None) is not None})
+
+    submit_order = sorted(
+        range(len(enzyme_specs)), reverse=True,
+        key=lambda i: enzyme_data_size(
+            enzyme_specs[i]["enzyme_id"], enzyme_specs[i]["path_to_dir"]))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            i: executor.submit(
+                _make_enzyme_module_with_reports, list(report_lists[i]),
+                **enzyme_specs[i])
+            for i in submit_order}
+        enzyme_modules = []
+        for i in range(len(enzyme_specs)):
+            enzyme_module, reports = futures[i].result()
+            for key, records in iteritems(reports):
+                report_lists[i][key].extend(records)
+            enzyme_modules.append(enzyme_module)
+    return enzyme_modules
+
+
 def metabolites_from_txt(enzyme_module, species_filepath):
     """Create metabolites from a text file."""
     # Create ID map dict for species
     enzyme_module.id_map["species"] = {}
 
     # Read metabolites from files
-    with open(species_filepath, "r") as f:
+    with open_enzyme_file(species_filepath) as f:
         original_ids = [l.strip() for l in f.readlines()]
 
     species = []
@@ -208,31 +1457,37 @@ def reactions_from_txt(enzyme_module, reactions_filepath):
     enzyme_module.id_map["reactions"] = {}
 
     # Read reactions from files
-    with open(reactions_filepath, "r") as f:
+    with open_enzyme_file(reactions_filepath) as f:
         reaction_strings = [l.strip() for l in f.readlines()]
 
+    # Map original specie IDs directly to the metabolite objects
+    metabolites = {
+        orig_id: enzyme_module.metabolites.get_by_id(new_id)
+        for orig_id, new_id in iteritems(enzyme_module.id_map["species"])}
+    reactions = []
     for reaction_str in reaction_strings:
         # Split reaction ID from reaction formula
         orig_id, reaction_str = reaction_str.split(r": ")
         new_id = prefix_number_id(re.sub(r"\$", "_", orig_id))
-        # Make EnzymeModuleReaction object and add to model
+        # Make EnzymeModuleReaction object
         reaction = EnzymeModuleReaction(
             id_or_reaction=new_id,
             enzyme_module_id=enzyme_module.id)
-        enzyme_module.add_reactions([reaction])
-
-        # Fix specie IDs in reaction string
-        species_list = iconcat(*[
-            s.split(r" + ") for s in reaction_str.strip().split(r" <=> ")])
-        for specie_id in species_list:
-            reaction_str = re.sub(
-                specie_id.replace(r"[", r"\[").replace(r"]", r"\]"),
-                enzyme_module.id_map["species"][specie_id],
-                reaction_str, 1)
-        # Build reaction from string.
-        reaction.build_reaction_from_string(reaction_str)
+
+        # Build reaction from species on each side of the reaction string
+        stoichiometry = {}
+        for coefficient, side in zip(
+           [-1, 1], reaction_str.strip().split(r" <=> ")):
+            for specie_id in side.split(r" + "):
+                metabolite = metabolites[specie_id]
+                stoichiometry[metabolite] = \
+                    stoichiometry.get(metabolite, 0) + coefficient
+        reaction.add_metabolites(stoichiometry)
+        reactions.append(reaction)
         # Store ID mapping
         enzyme_module.id_map["reactions"][orig_id] = new_id
+    # Add EnzymeModuleReactions to enzyme module
+    enzyme_module.add_reactions(reactions)
 
     return None
 
@@ -240,27 +1495,37 @@ def reactions_from_txt(enzyme_module, reactions_filepath):
 def rateconsts_from_txt(enzyme_module, kcluster, labels_filepath,
                         clusters_filepath):
     """Get values of forward and reverse rate constants from text files."""
+    rateconsts_from_clusters(
+        enzyme_module, kcluster,
+        *read_rateconst_clusters(labels_filepath, clusters_filepath))
+
+    return None
+
+
+def rateconsts_from_clusters(enzyme_module, kcluster, rateconst_labels,
+                             rateconst_clusters):
+    """Set forward and reverse rate constants from one rate constant cluster.
+    """
     enzyme_module.id_map["kf"] = {}
     enzyme_module.id_map["kr"] = {}
 
-    # Read rate constant labels from files
-    with open(labels_filepath, "r") as f:
-        rateconst_labels = [l.strip() for l in f.readlines()]
-    # Read rate constant values from files
-    with open(clusters_filepath, "r") as f:
-        lines = f.readlines()
-    try:
-        values_txt = lines[kcluster - 1]
-    except IndexError:
+    if not 1 <= kcluster <= len(rateconst_clusters):
         raise IndexError(
             "Invalid kcluster. Must be an int between [1, {}], ".format(
-                int(len(lines))))
-    values_txt = values_txt.strip().lstrip("{").rstrip("}")
+                int(len(rateconst_clusters))))
+
+    # Index reactions of symmetry models by their base reaction ID
+    symmetric_reactions = {}
+    for orig_id, new_id in iteritems(enzyme_module.id_map["reactions"]):
+        if "$" in orig_id:
+            symmetric_reactions.setdefault(orig_id.split("$")[0], []).append(
+                enzyme_module.reactions.get_by_id(new_id))
 
     # Assign values to rate constants
     to_unify = {}
     rateconst_values = {}
-    for rateconst, value in zip(rateconst_labels, values_txt.split(", ")):
+    for rateconst, value in zip(rateconst_labels,
+                                rateconst_clusters[kcluster - 1]):
         match = rateconst_re.search(rateconst)
         rid, direction = match.groups()
         key = {"fwd": "kf", "rev": "kr"}[direction]
@@ -269,32 +1534,25 @@ def rateconsts_from_txt(enzyme_module, kcluster, labels_filepath,
                 enzyme_module.id_map["reactions"][rid])
         except KeyError:
             new_rateconst = "_".join((key, rid))
-            to_unify[rid] = [r for r in enzyme_module.reactions if rid in r.id]
+            to_unify[rid] = symmetric_reactions.get(rid, [])
         else:
             new_rateconst = getattr(rxn, "_".join((key, "str")))
 
-        try:
-            value = float(value)
-        except ValueError:
-            value = float(value.replace("*^", "e"))
         enzyme_module.id_map[key][rateconst] = new_rateconst
-        rateconst_values[new_rateconst] = value # s 
+        rateconst_values[new_rateconst] = float(value)
     # Handle any symmetry model rate laws
     for rid, rxn_list in iteritems(to_unify):
         # Unity rate parameters
         enzyme_module.unify_rate_parameters(rxn_list, rid, rate_type=2)
         # Set symmetry coefficients for rate constants in rates
-        kf_str, kr_str = ["_".join((k, rid)) for k in ["kf", "kr"]]
+        kf, kr = [sym.Symbol("_".join((k, rid))) for k in ["kf", "kr"]]
         for i, rxn in enumerate(sorted(rxn_list, key=attrgetter("id"))):
-            rate_equation = str(strip_time(rxn.rate))
-            rate_equation = rate_equation.replace(
-                kr_str, "{0}*{1}".format(str(i + 1), kr_str))
-            rate_equation = rate_equation.replace(
-                kf_str, "{0}*{1}".format(str(len(rxn_list) - i), kf_str))
-            # Add as a custom rate
+            # Add as a custom rate, one reaction at a time since MASS has no
+            # way of adding several custom rates at once
             enzyme_module.add_custom_rate(
-                rxn, rate_equation, custom_parameters={
-                    kf_str: None, kr_str: None})
+                rxn, rxn.rate.xreplace({
+                    kf: (len(rxn_list) - i) * kf, kr: (i + 1) * kr}),
+                custom_parameters={str(kf): None, str(kr): None})
 
     # Update enzyme module with values
     enzyme_module.update_parameters(rateconst_values)
@@ -302,32 +1560,43 @@ def rateconsts_from_txt(enzyme_module, kcluster, labels_filepath,
     return None
 
 
-def kinetic_rate_law_from_txt(enzyme_module, rate_law_filepath):
+def kinetic_rate_law_from_txt(enzyme_module, rate_law_filepath,
+                              cache_dir=None):
     """Get the symbolic rate law equation from a text file."""
-    # Read rate constant labels from files
-    with open(rate_law_filepath, "r") as f:
-        rate_law = f.read()
     enzyme_module.get_rate_expressions(rate_type=2, update_reactions=True)
-    rate_law = fix_equation_variables(enzyme_module, rate_law)
-    enzyme_module.enzyme_rate_equation = sym.sympify(
-        rate_law, locals=enzyme_module._get_all_parameters())
+    # Stream the rate law from the file into an equation
+    rate_law = parse_equation_file(enzyme_module, rate_law_filepath, cache_dir)
+    enzyme_module.enzyme_rate_equation = substitute_parameters(
+        enzyme_module, rate_law)
 
     return None
 
 
 def steady_state_concentrations_from_txt(enzyme_module, eq_filepath, specie,
-                                         concentrations, zero_tol):
-    """Get an equation for enzyme form concentration from a text file."""
-    # Read rate constant labels from files
-    with open(eq_filepath, "r") as f:
-        ss_eq = f.read()
-    ss_eq = fix_equation_variables(enzyme_module, ss_eq)
-    ss_eq = sym.sympify(ss_eq, locals=enzyme_module._get_all_parameters())
-    e_tot = {
-        enzyme_module.id + "_Total": enzyme_module.enzyme_concentration_total}
-    ic = float(ss_eq.subs(concentrations).subs(e_tot))
+                                         concentrations, zero_tol,
+                                         compiled=False, cache_dir=None):
+    """Get an equation for enzyme form concentration from a text file.
+
+    If ``compiled`` is True, the equation is lambdified once and evaluated as
+    a plain function call instead of through repeated symbolic substitution.
+    Parsed equations are stored in ``cache_dir`` if provided. The symbolic
+    equation, or the compiled function, is returned.
+    """
+    # Stream the equation from the file
+    if compiled:
+        ss_eq = compile_equation_file(enzyme_module, eq_filepath, cache_dir)
+        ic = float(ss_eq(
+            *equation_argument_values(enzyme_module, concentrations)))
+    else:
+        ss_eq = substitute_parameters(
+            enzyme_module,
+            parse_equation_file(enzyme_module, eq_filepath, cache_dir))
+        e_tot = {
+            enzyme_module.id + "_Total":
+            enzyme_module.enzyme_concentration_total}
+        ic = float(ss_eq.subs(concentrations).subs(e_tot))
     if abs(ic) <= zero_tol:
         ic = 0
     specie.ic = ic
 
-    return None
\ No newline at end of file
+    return ss_eq
\ No newline at end of file
@@ -0,0 +1,420 @@
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from six import iteritems
+
+import numpy as np
+import pandas as pd
+
+from mass import Simulation
+from mass.io.json import load_json_model, save_json_model
+from mass.thermo import sample_concentrations
+
+
+# Names of the files that record the progress of an ensemble directory
+ENSEMBLE_SAMPLES_FILENAME = "conc_samples.csv"
+ENSEMBLE_MANIFEST_FILENAME = "manifest.jsonl"
+
+# Integrator tolerances used when simulating ensemble models
+ENSEMBLE_ABSOLUTE_TOLERANCE = 1e-15
+ENSEMBLE_RELATIVE_TOLERANCE = 1e-9
+
+# Model shared by the samples handled in a worker process and the
+# simulations of a worker, reused for models with the same structure
+_worker_state = {}
+_worker_simulations = {}
+
+
+def sample_ensemble_concentrations(conc_solver, n_models, output_dir,
+                                   seed=None, processes=None):
+    """Sample concentrations for an ensemble and store them on disk.
+
+    Samples are drawn with the parallel OptGP sampler. If the ensemble
+    directory already contains samples, those are returned instead so that
+    an interrupted ensemble is resumed with the same samples.
+    """
+    filepath = os.path.join(output_dir, ENSEMBLE_SAMPLES_FILENAME)
+    if os.path.isfile(filepath):
+        conc_samples = pd.read_csv(filepath, index_col=0)
+        if len(conc_samples) != n_models:
+            raise ValueError(
+                "{0} contains {1:d} samples instead of {2:d}. Remove the file "
+                "to draw new samples.".format(
+                    filepath, len(conc_samples), n_models))
+        return conc_samples
+
+    # OptGP may return more samples than requested, e.g. if the number of
+    # samples is not a multiple of the number of processes
+    conc_samples = sample_concentrations(
+        conc_solver, n=n_models, method="optgp", processes=processes or 1,
+        seed=seed).iloc[:n_models]
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    conc_samples.to_csv(filepath)
+
+    return conc_samples
+
+
+def sink_rate_constants(S, steady_state_fluxes, conc_samples):
+    """Return metabolite imbalances and rate constants of their sinks.
+
+    Imbalances are the product of the stoichiometric matrix and the steady
+    state fluxes, keeping only metabolites that are not balanced. Rate
+    constants of the sinks are calculated for all samples at once as the
+    magnitude of the imbalance divided by the sampled concentration, with
+    one row per sample and one column per imbalanced metabolite.
+    """
+    imbalances = S.dot(pd.Series(steady_state_fluxes))
+    imbalances = imbalances[imbalances != 0]
+    rate_constants = pd.DataFrame(
+        np.abs(imbalances.values) / conc_samples[imbalances.index].values,
+        index=conc_samples.index, columns=imbalances.index)
+
+    return imbalances, rate_constants
+
+
+def add_ensemble_sinks(mass_model, imbalances):
+    """Return a copy of a model with sinks for imbalanced metabolites.
+
+    The sinks carry the imbalance as their steady state flux, so only their
+    rate constants and boundary conditions differ between ensemble models.
+    Also returns a dict of metabolite IDs and their sink reactions.
+    """
+    mass_model = mass_model.copy()
+    sinks = {}
+    for mid, imbalance in iteritems(imbalances):
+        met = mass_model.metabolites.get_by_id(mid)
+        boundary_reaction = mass_model.add_boundary(
+            mid, "sink", boundary_condition=met.ic)
+        boundary_reaction.Keq = 1
+        if imbalance < 0:
+            boundary_reaction.reverse_stoichiometry(inplace=True)
+            imbalance = -imbalance
+        boundary_reaction.steady_state_flux = imbalance
+        sinks[mid] = boundary_reaction
+
+    return mass_model, sinks
+
+
+def sink_parameters(sinks, rate_constants, concentrations):
+    """Return rate constants and boundary conditions of sinks per sample.
+
+    ``rate_constants`` and ``concentrations`` have one row per sample and one
+    column per imbalanced metabolite. Returns a list with a tuple of dicts
+    of rate constants and boundary conditions for each sample.
+    """
+    mids = list(rate_constants.columns)
+    kf_strs = [sinks[mid].kf_str for mid in mids]
+    boundary_mets = [sinks[mid].boundary_metabolite for mid in mids]
+    return [
+        (dict(zip(kf_strs, kfs)), dict(zip(boundary_mets, ics)))
+        for kfs, ics in zip(
+            rate_constants.values.tolist(),
+            concentrations[mids].values.tolist())]
+
+
+def make_ensemble_model(mass_model, conc_sample, model_id, sink_kfs,
+                        sink_conditions):
+    """Return a copy of a model updated with one concentration sample.
+
+    The model must already contain the sinks of the ensemble, see
+    :func:`add_ensemble_sinks`. Their rate constants and boundary conditions
+    are set in bulk and the PERCs of the remaining reactions recalculated.
+    Returns ``None`` if the PERCs cannot be calculated.
+    """
+    new_model = mass_model.copy()
+    new_model.id = model_id
+    new_model.update_initial_conditions(conc_sample)
+    new_model.update_parameters(sink_kfs)
+    new_model.add_boundary_conditions(sink_conditions)
+
+    try:
+        new_model.calculate_PERCs(
+            fluxes={
+                r: v for r, v in iteritems(new_model.steady_state_fluxes)
+                if not r.boundary},
+            update_reactions=True)
+    except ValueError:
+        return None
+
+    return new_model
+
+
+def model_structure_key(mass_model):
+    """Return a key shared by models with the same reactions and species."""
+    return (
+        tuple(sorted(r.id for r in mass_model.reactions)),
+        tuple(sorted(m.id for m in mass_model.metabolites)))
+
+
+def ensemble_simulation(mass_model, simulations):
+    """Return a simulation of a model, reusing one for the same structure.
+
+    ``simulations`` is a dict of simulations by structure. Models sharing
+    the structure of a model already simulated are added to its simulation
+    so that the integrator is only compiled once. Remove them again with
+    :func:`remove_ensemble_model` once they have been simulated.
+    """
+    key = model_structure_key(mass_model)
+    if key not in simulations:
+        sim = Simulation(mass_model, verbose=False)
+        sim.integrator.absolute_tolerance = ENSEMBLE_ABSOLUTE_TOLERANCE
+        sim.integrator.relative_tolerance = ENSEMBLE_RELATIVE_TOLERANCE
+        simulations[key] = sim
+    elif mass_model.id not in simulations[key].models:
+        simulations[key].add_models(mass_model, disable_safe_load=True)
+
+    return simulations[key]
+
+
+def remove_ensemble_model(sim, mass_model):
+    """Remove a simulated model from a simulation reused for its structure.
+
+    The reference model of the simulation is kept, so a simulation only
+    holds its reference model and the model being simulated.
+    """
+    if mass_model.id != sim.reference_model.id:
+        sim.remove_models(mass_model, verbose=False)
+
+
+def has_steady_state(mass_model, tfinal=1e6, simulations=None):
+    """Return whether a steady state is found by simulating a model."""
+    if simulations is None:
+        simulations = {}
+    sim = ensemble_simulation(mass_model, simulations)
+    try:
+        conc_sol, flux_sol = sim.find_steady_state(
+            models=mass_model, strategy="simulate", update_values=True,
+            tfinal=tfinal)
+    finally:
+        remove_ensemble_model(sim, mass_model)
+
+    return bool(conc_sol and flux_sol)
+
+
+def read_ensemble_manifest(output_dir):
+    """Return the status of each model recorded for an ensemble directory."""
+    statuses = {}
+    filepath = os.path.join(output_dir, ENSEMBLE_MANIFEST_FILENAME)
+    if os.path.isfile(filepath):
+        with open(filepath) as f:
+            for line in f:
+                # Ignore a line left incomplete by an interruption
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                statuses[entry["id"]] = entry["status"]
+
+    return statuses
+
+
+def _init_ensemble_worker(mass_model, output_dir, tfinal):
+    """Store the model shared by all samples handled by a worker."""
+    _worker_state.update(
+        mass_model=mass_model, output_dir=output_dir, tfinal=tfinal)
+
+
+def _make_ensemble_shard(samples):
+    """Make and save the models for a shard of concentration samples."""
+    statuses = []
+    for model_id, conc_sample, sink_kfs, sink_conditions in samples:
+        new_model = make_ensemble_model(
+            _worker_state["mass_model"], conc_sample, model_id, sink_kfs,
+            sink_conditions)
+        if new_model is None:
+            statuses.append((model_id, "negative_percs"))
+            continue
+        tfinal = _worker_state["tfinal"]
+        if tfinal is not None and not has_steady_state(
+           new_model, tfinal, _worker_simulations):
+            statuses.append((model_id, "no_steady_state"))
+            continue
+        # Write to a temporary file first so that interrupted writes are
+        # never mistaken for finished models when resuming.
+        filepath = os.path.join(
+            _worker_state["output_dir"], model_id + ".json")
+        save_json_model(mass_model=new_model, filename=filepath + ".tmp")
+        os.replace(filepath + ".tmp", filepath)
+        statuses.append((model_id, "saved"))
+
+    return statuses
+
+
+def generate_ensemble_models(mass_model, conc_samples, output_dir,
+                             max_workers=None, shard_size=10, tfinal=1e6,
+                             verbose=False):
+    """Make ensemble models from concentration samples in parallel.
+
+    Samples are split into shards handled by a pool of processes. Each model
+    is written to ``output_dir`` as a MASS JSON model as soon as it is made,
+    and the outcome for each sample is appended to a manifest. Samples with
+    an outcome in the manifest or a saved model are skipped, so calling the
+    function again resumes an interrupted ensemble. Models are checked for a
+    steady state by simulating up to ``tfinal`` unless it is ``None``.
+
+    Returns a Series with the status of every model in the ensemble, which
+    is one of "saved", "negative_percs" or "no_steady_state".
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    statuses = read_ensemble_manifest(output_dir)
+
+    # Imbalances only depend on the fluxes, so sinks are added once and their
+    # rate constants are calculated for all samples together. Metabolites
+    # that are not sampled keep their initial condition.
+    ics = pd.Series({met.id: met.ic for met in mass_model.metabolites})
+    concentrations = conc_samples.reindex(columns=ics.index).fillna(ics)
+    imbalances, rate_constants = sink_rate_constants(
+        mass_model.update_S(array_type="DataFrame", update_model=False),
+        {r.id: v for r, v in iteritems(mass_model.steady_state_fluxes)},
+        concentrations)
+    mass_model, sinks = add_ensemble_sinks(mass_model, imbalances)
+    parameters = dict(zip(
+        conc_samples.index,
+        sink_parameters(sinks, rate_constants, concentrations)))
+
+    manifest_path = os.path.join(output_dir, ENSEMBLE_MANIFEST_FILENAME)
+    with open(manifest_path, "a") as manifest:
+        def record(model_id, status):
+            statuses[model_id] = status
+            manifest.write(json.dumps({"id": model_id, "status": status}))
+            manifest.write("\n")
+            manifest.flush()
+
+        pending = []
+        for idx, conc_sample in conc_samples.iterrows():
+            model_id = "{0}_C{1:d}".format(mass_model.id, idx)
+            if model_id in statuses:
+                continue
+            # Models saved before an interruption but not yet recorded
+            if os.path.isfile(os.path.join(output_dir, model_id + ".json")):
+                record(model_id, "saved")
+                continue
+            pending.append(
+                (model_id, conc_sample.to_dict()) + parameters[idx])
+
+        shards = [pending[i:i + shard_size]
+                  for i in range(0, len(pending), shard_size)]
+        with ProcessPoolExecutor(
+           max_workers=max_workers, initializer=_init_ensemble_worker,
+           initargs=(mass_model, output_dir, tfinal)) as executor:
+            futures = [
+                executor.submit(_make_ensemble_shard, shard)
+                for shard in shards]
+            for future in as_completed(futures):
+                for model_id, status in future.result():
+                    record(model_id, status)
+                    if verbose:
+                        print("{0}: {1}".format(model_id, status))
+
+    return pd.Series(statuses, name="status").rename_axis("model")
+
+
+def run_ensemble_pipeline(mass_model, conc_solver, n_models, output_dir,
+                          seed=None, processes=None, **kwargs):
+    """Sample concentrations and make ensemble models in parallel processes.
+
+    ``processes`` is used both for sampling and for making models. Keyword
+    arguments are passed to :func:`generate_ensemble_models`.
+    """
+    conc_samples = sample_ensemble_concentrations(
+        conc_solver, n_models, output_dir, seed=seed, processes=processes)
+    kwargs.setdefault("max_workers", processes)
+
+    return generate_ensemble_models(
+        mass_model, conc_samples, output_dir, **kwargs)
+
+
+def _simulate_ensemble_shard(filepaths, time, perturbations, steady_state):
+    """Load and simulate a shard of ensemble models in a worker."""
+    results = []
+    for filepath in filepaths:
+        mass_model = load_json_model(filename=filepath)
+        sim = ensemble_simulation(mass_model, _worker_simulations)
+        try:
+            if steady_state:
+                conc_sol, flux_sol = sim.find_steady_state(
+                    models=mass_model, strategy="simulate",
+                    perturbations=perturbations, tfinal=time[1])
+            else:
+                conc_sol, flux_sol = sim.simulate(
+                    mass_model, time=time, perturbations=perturbations)
+        finally:
+            remove_ensemble_model(sim, mass_model)
+        if not (conc_sol and flux_sol):
+            results.append((mass_model.id, None, None))
+            continue
+        # Steady states have one row, time courses one row per time point
+        if steady_state:
+            conc_df = pd.DataFrame([dict(conc_sol)])
+            flux_df = pd.DataFrame([dict(flux_sol)])
+        else:
+            index = pd.Index(conc_sol.time, name="time")
+            conc_df = pd.DataFrame(dict(conc_sol), index=index)
+            flux_df = pd.DataFrame(dict(flux_sol), index=index)
+        results.append((mass_model.id, conc_df, flux_df))
+
+    return results
+
+
+def simulate_ensemble(models_dir, time=(0, 1e5), perturbations=None,
+                      steady_state=False, max_workers=None, shard_size=10):
+    """Simulate every MASS JSON model in a directory in parallel processes.
+
+    Each worker keeps one simulation per model structure, so the integrator
+    is compiled once per worker for ensemble models that share a structure.
+    ``time`` is passed to the simulation; include the number of time points,
+    e.g. ``(0, 1e5, 1001)``, for all models to share the same times.
+    If ``steady_state`` is True, steady states are found by simulating until
+    the final time instead.
+
+    Returns DataFrames of concentrations and fluxes, indexed by model ID and
+    time unless only steady states are found, and a list of the IDs of
+    models that could not be simulated. The DataFrames are empty if no
+    models could be simulated.
+    """
+    filepaths = sorted(glob.glob(os.path.join(models_dir, "*.json")))
+    shards = [filepaths[i:i + shard_size]
+              for i in range(0, len(filepaths), shard_size)]
+
+    conc_results, flux_results, failed = {}, {}, []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _simulate_ensemble_shard, shard, time, perturbations,
+                steady_state)
+            for shard in shards]
+        for future in as_completed(futures):
+            for model_id, conc_df, flux_df in future.result():
+                if conc_df is None:
+                    failed.append(model_id)
+                    continue
+                conc_results[model_id] = conc_df
+                flux_results[model_id] = flux_df
+
+    model_ids = sorted(conc_results)
+    # No models in the directory or none could be simulated
+    if not model_ids:
+        index = pd.Index([], name="model")
+        return (
+            pd.DataFrame(index=index), pd.DataFrame(index=index),
+            sorted(failed))
+    if steady_state:
+        concentrations = pd.concat(
+            [conc_results[i] for i in model_ids], ignore_index=True)
+        fluxes = pd.concat(
+            [flux_results[i] for i in model_ids], ignore_index=True)
+        concentrations.index = fluxes.index = pd.Index(
+            model_ids, name="model")
+    else:
+        concentrations = pd.concat(
+            [conc_results[i] for i in model_ids], keys=model_ids,
+            names=["model"])
+        fluxes = pd.concat(
+            [flux_results[i] for i in model_ids], keys=model_ids,
+            names=["model"])
+
+    return concentrations, fluxes, sorted(failed)